@@ -0,0 +1,61 @@
+# Micro-benchmark of the password check done by login_page at different bcrypt
+# work factors. It measures User.check_password_correction on an in-memory
+# user, i.e. the CPU part of a login without the database round trip.
+#
+# usage (from the flask_web_app_course directory):
+#   python benchmarks/bench_login.py --costs 4 8 10 12 --attempts 20 --concurrency 8
+
+# native imports
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# local imports
+from market import app, hasher
+from market.models import User
+
+PASSWORD = 'benchmark-password'
+
+
+def time_logins(user, attempts: int, concurrency: int) -> list:
+    def attempt(_):
+        started = time.perf_counter()
+        user.check_password_correction(attempted_password=PASSWORD)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        return list(clients.map(attempt, range(attempts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bcrypt cost micro-benchmark of the login path')
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--attempts', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='simultaneous login attempts (request threads)')
+    args = parser.parse_args()
+
+    print(f"hashing workers: {app.config['BCRYPT_WORKERS']}, "
+          f"concurrent attempts: {args.concurrency}")
+    print(f"{'cost':>4} {'mean ms':>9} {'p99 ms':>9} {'logins/s':>9}")
+    for cost in args.costs:
+        app.config['BCRYPT_LOG_ROUNDS'] = cost
+        user = User(username='bench', email='bench@example.com', password_hash=hasher.hash(PASSWORD))
+
+        started = time.perf_counter()
+        timings = time_logins(user, args.attempts, args.concurrency)
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f"{cost:>4} {statistics.mean(timings) * 1000:>9.1f} "
+              f"{p99 * 1000:>9.1f} {len(timings) / elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
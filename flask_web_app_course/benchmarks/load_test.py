@@ -0,0 +1,235 @@
+# Load test of the market app through the Flask test client.
+#
+# Seeds a throw-away SQLite database with N users and M items, then runs each
+# scenario (home, market listing, purchase, sell, login, register) from
+# --concurrency threads, every thread with its own logged-in client, and
+# reports throughput and p50/p99 latency. Results are written as JSON so runs
+# on different commits can be compared with --compare.
+#
+# usage (from the flask_web_app_course directory):
+#   python benchmarks/load_test.py --users 50 --items 5000 --concurrency 8 --requests 400
+#   python benchmarks/load_test.py --compare benchmarks/results/<old commit>.json
+
+# native imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = PROJECT_DIR / 'benchmarks' / 'results'
+SCENARIOS = ('home', 'market', 'purchase', 'sell', 'login', 'register')
+PASSWORD = 'benchmark-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test of the market app.')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='work factor for seeded and registered users')
+    parser.add_argument('--output', type=Path, help='JSON file, default benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', type=Path, help='earlier result file to compare against')
+    return parser.parse_args()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# The app reads its settings when 'market' is imported, so the environment has
+# to point at the scratch database before that.
+def load_app(database_path: Path, bcrypt_rounds: int):
+    os.environ['DATABASE_URL'] = f'sqlite:///{database_path}'
+    os.environ['SESSION_SQLITE_PATH'] = str(database_path.parent / 'sessions.db')
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(bcrypt_rounds)
+    sys.path.insert(0, str(PROJECT_DIR))
+
+    from market import app, db, hasher
+    from market.models import User, Item
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    # the login scenario repeats a few accounts far faster than the throttle allows
+    app.config['LOGIN_RATE_LIMIT'] = False
+    return app, db, hasher, User, Item
+
+
+def seed(app, db, hasher, User, Item, users: int, items: int):
+    with app.app_context():
+        db.create_all()
+        password_hash = hasher.hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'bench{i}', 'email': f'bench{i}@example.com',
+             'password_hash': password_hash, 'budget': 10 ** 9}
+            for i in range(users)
+        ])
+        db.session.execute(Item.__table__.insert(), [
+            {'name': f'item{i}', 'price': i % 100 + 1, 'barcode': f'{i:012d}',
+             'description': f'benchmark item {i}'}
+            for i in range(items)
+        ])
+        db.session.commit()
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+# Runs 'requests' calls of request(client, n) spread over the worker threads.
+# request() returns whether the call succeeded, or a callable answering that,
+# for checks that query the database and must stay out of the measured time.
+# Returns latency statistics in milliseconds.
+def run_scenario(clients: list, requests: int, request) -> dict:
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(index):
+        nonlocal errors
+        client = clients[index]
+        own = []
+        own_errors = 0
+        for n in range(index, requests, len(clients)):
+            started = time.perf_counter()
+            ok = request(client, n)
+            own.append(time.perf_counter() - started)
+            if callable(ok):
+                ok = ok()
+            own_errors += not ok
+        with lock:
+            latencies.extend(own)
+            errors += own_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        list(pool.map(worker, range(len(clients))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    args = parse_args()
+    if args.users < args.concurrency:
+        sys.exit('--users must be at least --concurrency, every thread logs in as its own user')
+
+    scratch = tempfile.TemporaryDirectory()
+    app, db, hasher, User, Item = load_app(Path(scratch.name) / 'market.db', args.bcrypt_rounds)
+    seed(app, db, hasher, User, Item, args.users, args.items)
+
+    clients = []
+    for i in range(args.concurrency):
+        client = app.test_client()
+        client.post('/login', data={'username': f'bench{i}', 'password': PASSWORD})
+        clients.append(client)
+
+    # every thread buys (and later sells) its own slice of the catalog, so the
+    # purchase numbers measure the success path rather than contention
+    purchased = {}
+    registered = iter(range(10 ** 9))
+    registered_lock = threading.Lock()
+    # /market answers every trade with a redirect, success or not; the outcome
+    # is the flash message queued for the next page. Taking it out of the
+    # session also keeps the session from growing over the run.
+    def traded(client):
+        with client.session_transaction() as session:
+            flashes = session.pop('_flashes', [])
+        return bool(flashes) and flashes[-1][0] == 'success'
+
+    def purchase(client, n):
+        item_id = n % args.items + 1
+        response = client.post('/market', data={'purchased_item': item_id})
+
+        def bought():
+            if response.status_code != 302 or not traded(client):
+                return False
+            purchased.setdefault(id(client), []).append(item_id)
+            return True
+        return bought
+
+    def sell(client, n):
+        owned = purchased.get(id(client))
+        if not owned:
+            return False
+        response = client.post('/market', data={'sold_item': owned.pop()})
+        return lambda: response.status_code == 302 and traded(client)
+
+    def login(client, n):
+        response = client.post('/login', data={'username': f'bench{n % args.concurrency}',
+                                               'password': PASSWORD})
+        return response.status_code == 302
+
+    def register(client, n):
+        with registered_lock:
+            number = next(registered)
+        response = app.test_client().post('/register', data={
+            'username': f'new{number}', 'email': f'new{number}@example.com',
+            'password1': PASSWORD, 'password2': PASSWORD})
+        return response.status_code == 302
+
+    requests = {
+        'home': lambda client, n: client.get('/home').status_code == 200,
+        'market': lambda client, n: client.get('/market').status_code == 200,
+        'purchase': purchase,
+        'sell': sell,
+        'login': login,
+        'register': register,
+    }
+
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario in args.scenarios:
+            results[scenario] = run_scenario(clients, args.requests, requests[scenario])
+            print(f"{scenario:>9}: {results[scenario]['throughput_rps']:>8} req/s  "
+                  f"p50 {results[scenario]['p50_ms']:>8} ms  p99 {results[scenario]['p99_ms']:>8} ms  "
+                  f"errors {results[scenario]['errors']}")
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'config': {key: getattr(args, key) for key in
+                   ('users', 'items', 'concurrency', 'requests', 'bcrypt_rounds')},
+        'results': results,
+    }
+    output = args.output or RESULTS_DIR / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'results written to {output}')
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        print(f"compared with {baseline['commit']}:")
+        for scenario, result in results.items():
+            before = baseline['results'].get(scenario)
+            if before:
+                change = (result['throughput_rps'] / before['throughput_rps'] - 1) * 100
+                print(f"{scenario:>9}: throughput {change:+.1f}%  "
+                      f"p99 {before['p99_ms']} -> {result['p99_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# gunicorn settings, used with: gunicorn -c gunicorn.conf.py wsgi:app
+# Workers and threads are derived from the database pool settings of
+# market/config.py unless GUNICORN_WORKERS / GUNICORN_THREADS are set.
+#
+# Nothing is imported from the market package here: importing market.config
+# runs market/__init__.py, which would build the whole app (engines, session
+# store, hash pool, routes) in the master process before the workers fork.
+
+# native imports
+import os
+
+
+def env_int(name: str, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+# Sizing derived from the connection pool. Every worker process has its own
+# pool, so each worker runs at most as many request threads as its pool can
+# serve at once, and all workers together stay below the connections the
+# database server accepts (DB_MAX_CONNECTIONS).
+def recommended_threads() -> int:
+    return env_int('DB_POOL_SIZE', 5)
+
+def recommended_workers() -> int:
+    connections_per_worker = env_int('DB_POOL_SIZE', 5) + env_int('DB_MAX_OVERFLOW', 10)
+    by_database = env_int('DB_MAX_CONNECTIONS', 100) // connections_per_worker
+    by_cpu = 2 * (os.cpu_count() or 1) + 1
+    return max(1, min(by_database, by_cpu))
+
+
+bind = f"0.0.0.0:{env_int('PORT', 8000)}"
+worker_class = 'gthread'
+workers = env_int('GUNICORN_WORKERS', recommended_workers())
+threads = env_int('GUNICORN_THREADS', recommended_threads())
+timeout = env_int('GUNICORN_TIMEOUT', 30)
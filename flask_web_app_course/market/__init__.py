@@ -1,26 +1,50 @@
-# native imports
-from pathlib import Path
-
 # 3rd party imports
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_fontawesome import FontAwesome
+from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# local imports
+from market.config import Config, MIGRATIONS_DIRECTORY
+from market.cache import make_cache
+from market.hashing import PasswordHasher
+from market.database import RoutingSession, init_database
+from market.metrics import init_metrics
+from market.purchase_queue import PurchaseQueue
+from market.template_helpers import init_template_helpers
+from market.asset_pipeline import AssetPipeline
+from market.responses import init_responses
+from market.sessions import init_sessions
+from market.ratelimit import RateLimiter
+
 # inits
 app = Flask(__name__) # __name__ refs to the current local py file
 
-# point to the absolute path of the .db file (in Unix systems)
-root_abs_path = Path.cwd()
-project_db_path = '/market/market.db'
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{root_abs_path}{project_db_path}'
-app.config['SECRET_KEY'] = '40217598b125400a38f5a01f'
+# database url, engine pool and app settings, tunable through the environment
+app.config.from_object(Config)
+
+# behind a reverse proxy the client IP comes from X-Forwarded-For
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+# server-side sessions, the cookie only carries a signed session id
+sessions = init_sessions(app)
 
 # store passwords as hashes not plain text
 bcrypt = Bcrypt(app)
+hasher = PasswordHasher(app, bcrypt)
+
+# init database. The routing session sends reads inside read_replica() blocks
+# to the read-only engine, connections get the SQLite PRAGMAs
+db = SQLAlchemy(app, session_options={'class_': RoutingSession}) # database
+init_database(app, db)
 
-# init database
-db = SQLAlchemy(app) # database
+# schema migrations ('flask db ...'), alembic revisions in migrations/ next to
+# the package. Batch mode rebuilds SQLite tables for the ALTERs it does not support
+migrate = Migrate(app, db, directory=MIGRATIONS_DIRECTORY, render_as_batch=True)
 
 # init login manager
 login_manager = LoginManager(app)
@@ -30,5 +54,28 @@ login_manager.login_message_category = 'info' # outputs message nicely
 # init fontawesome object
 fa = FontAwesome(app)
 
+# jinja filters such as '|money'
+init_template_helpers(app)
+
+# fingerprinted css/js/images on /assets, linked with asset_url()
+assets = AssetPipeline(app)
+
+# gzip compression and ETags / 304s for GET responses
+init_responses(app)
+
+# init fragment cache, and the user loader's cache so logged-in users do not
+# evict rendered pages
+cache = make_cache(app)
+user_cache = make_cache(app, max_entries=app.config['USER_CACHE_SIZE'])
+
+# per-item purchase serialization and idempotency keys
+purchase_queue = PurchaseQueue(app)
+
+# login throttling per client IP and username
+limiter = RateLimiter(app)
+
+# opt-in request metrics on /metrics (MARKET_METRICS=1)
+metrics = init_metrics(app, db, hasher)
+
 # use it here to bypass circular import error
-from market import routes
\ No newline at end of file
+from market import routes, commands
\ No newline at end of file
@@ -0,0 +1,152 @@
+# native imports
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
+from pathlib import Path
+
+# 3rd party imports
+from flask import abort, request, send_from_directory, url_for, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static assets of the market pages.
+#
+# Sources live in market/assets (css, js) and market/data/img. 'flask assets
+# build' bundles the CSS and the JS into one file each, minifies them, and
+# writes every asset to market/dist under a name carrying a hash of its
+# content, next to .gz (and .br, when the brotli package is installed)
+# variants and a manifest.json mapping logical names to fingerprinted ones.
+#
+# Templates link assets with asset_url('css/market.css'). Fingerprinted files
+# never change, so they are served with a one year immutable Cache-Control and
+# browsers never revalidate them; a new build means new URLs. Without a build
+# asset_url falls back to the unminified sources, served uncached.
+
+PACKAGE_DIR = Path(__file__).resolve().parent
+SOURCE_DIR = PACKAGE_DIR / 'assets'
+IMAGE_DIR = PACKAGE_DIR / 'data' / 'img'
+DIST_DIR = PACKAGE_DIR / 'dist'
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('.css', '.js', '.svg')
+# preferred first, .br only exists when brotli was available at build time
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(text: str) -> str:
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    # only after colons, 'a :hover' and 'a:hover' are different selectors
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+# whitespace only: drops indentation, blank lines and whole line comments,
+# which is safe for any script and gets most of the savings after gzip
+def minify_js(text: str) -> str:
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+# logical name -> list of source files, bundles first
+def collect_sources() -> dict:
+    sources = {
+        'css/market.css': sorted((SOURCE_DIR / 'css').glob('*.css')),
+        'js/market.js': sorted((SOURCE_DIR / 'js').glob('*.js')),
+    }
+    for image in sorted(IMAGE_DIR.glob('*')):
+        if image.is_file():
+            sources[f'img/{image.name}'] = [image]
+    return {name: files for name, files in sources.items() if files}
+
+
+def fingerprinted(name: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, dot, suffix = name.rpartition('.')
+    return f'{stem}.{digest}.{suffix}' if dot else f'{name}.{digest}'
+
+
+# Build every asset into output_dir and return the manifest. Output is
+# deterministic (gzip without timestamps), so unchanged sources keep their URLs.
+def build_assets(output_dir: Path = DIST_DIR) -> dict:
+    manifest = {}
+    for name, files in collect_sources().items():
+        if name.endswith('.css'):
+            content = minify_css('\n'.join(f.read_text(encoding='utf-8') for f in files)).encode('utf-8')
+        elif name.endswith('.js'):
+            content = minify_js(';\n'.join(f.read_text(encoding='utf-8') for f in files)).encode('utf-8')
+        else:
+            content = files[0].read_bytes()
+
+        target = output_dir / fingerprinted(name, content)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+        if target.suffix in COMPRESSIBLE:
+            target.with_name(target.name + '.gz').write_bytes(gzip.compress(content, 9, mtime=0))
+            if brotli is not None:
+                target.with_name(target.name + '.br').write_bytes(brotli.compress(content))
+        manifest[name] = target.relative_to(output_dir).as_posix()
+
+    (output_dir / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
+
+
+class AssetPipeline:
+
+    def __init__(self, app, dist_dir: Path = DIST_DIR):
+        self.dist_dir = dist_dir
+        self.manifest = {}
+        self.fingerprinted = set()
+        self.load_manifest()
+
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    # read once at startup, 'flask assets build' runs before the app is served
+    def load_manifest(self):
+        try:
+            self.manifest = json.loads((self.dist_dir / MANIFEST).read_text())
+        except (OSError, ValueError):
+            self.manifest = {}
+        self.fingerprinted = set(self.manifest.values())
+
+    def url(self, name: str) -> str:
+        return url_for('asset', filename=self.manifest.get(name, name))
+
+    def serve(self, filename: str):
+        if filename not in self.fingerprinted:
+            return self._serve_source(filename)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings and (self.dist_dir / (filename + suffix)).is_file():
+                response = send_from_directory(self.dist_dir, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist_dir, filename)
+
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    # unbuilt sources for development, uncached so edits show up on reload
+    @staticmethod
+    def _serve_source(filename: str):
+        files = collect_sources().get(filename)
+        if files is None:
+            abort(404)
+        if len(files) == 1:
+            return send_from_directory(files[0].parent, files[0].name, max_age=0)
+
+        bundle = '\n'.join(f.read_text(encoding='utf-8') for f in files)
+        response = Response(bundle, mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
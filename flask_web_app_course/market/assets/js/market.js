@@ -0,0 +1,44 @@
+// market page: fills the shared item modals when they are opened
+
+// item details are fetched once per item when a modal is first opened
+var itemDetails = {};
+
+function fetchItem(url) {
+    if (!itemDetails[url]) {
+        itemDetails[url] = fetch(url, {credentials: 'same-origin'}).then(function (response) {
+            if (!response.ok) {
+                delete itemDetails[url];
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        });
+    }
+    return itemDetails[url];
+}
+
+function fillModal(modal, item) {
+    modal.find('.js-item-name').text(item.name);
+    modal.find('.js-item-price').text(item.price.toLocaleString('en-US'));
+    modal.find('.js-item-description').text(item.description);
+}
+
+$('#Modal-MoreInfo, #Modal-PurchaseConfirm').on('show.bs.modal', function (event) {
+    var button = $(event.relatedTarget);
+    var modal = $(this);
+    modal.find('.js-item-name, .js-item-price').text('');
+    modal.find('.js-item-description').text('Loading...');
+    modal.find('#purchased_item').val(button.data('item-id'));
+    fetchItem(button.data('item-url')).then(function (item) {
+        fillModal(modal, item);
+    }).catch(function () {
+        modal.find('.js-item-description').text('Could not load this item.');
+    });
+});
+
+$('#Modal-SellingConfirm').on('show.bs.modal', function (event) {
+    var button = $(event.relatedTarget);
+    var modal = $(this);
+    modal.find('.js-item-name').text(button.data('item-name'));
+    modal.find('.js-item-price').text(button.data('item-price'));
+    modal.find('#sold_item').val(button.data('item-id'));
+});
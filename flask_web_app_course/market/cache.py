@@ -0,0 +1,92 @@
+# native imports
+import threading
+import time
+from collections import OrderedDict
+
+# 3rd party imports
+from werkzeug.utils import import_string
+
+
+# In-process LRU cache with optional per-entry expiry. It is the default
+# backend of 'market.cache'; any object with the same get/set/delete/incr
+# methods (e.g. a thin Redis or memcached wrapper) can be configured instead
+# through MARKET_CACHE_BACKEND so the entries are shared between workers.
+class LocalCache:
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            # mark as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    # 'timeout' is in seconds, None keeps the entry until it is evicted
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            # evict the least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def incr(self, key) -> int:
+        with self._lock:
+            expires_at, value = self._entries.get(key, (None, 0))
+            value += 1
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            return value
+
+
+# build the cache backend named in the app config ('module:Class' import
+# string), falling back to an in-process LRU cache of 'max_entries' entries
+# (default MARKET_CACHE_SIZE)
+def make_cache(app, max_entries: int = None):
+    backend = app.config.get('MARKET_CACHE_BACKEND')
+    if backend is None:
+        return LocalCache(max_entries=max_entries or app.config['MARKET_CACHE_SIZE'])
+
+    if isinstance(backend, str):
+        backend = import_string(backend)
+    return backend(app)
+
+
+# Version counter of the public catalog. Item.buy and Item.sell bump it, which
+# retires every cached catalog fragment at once: their keys embed the version,
+# so stale entries are never read again and simply age out of the LRU.
+CATALOG_VERSION_KEY = 'catalog:version'
+
+def catalog_version(cache) -> int:
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # (re)seed from the clock, so a counter lost to eviction or a backend
+        # restart never starts over and revives fragments of an old version
+        version = time.time_ns() // 1_000_000
+        cache.set(CATALOG_VERSION_KEY, version)
+    return int(version)
+
+def bump_catalog_version(cache) -> int:
+    catalog_version(cache)
+    return cache.incr(CATALOG_VERSION_KEY)
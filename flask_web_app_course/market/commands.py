@@ -0,0 +1,282 @@
+# native imports
+import csv
+import hashlib
+import json
+from itertools import islice
+from pathlib import Path
+
+# 3rd party imports
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, inspect, select, func, literal
+
+# local imports
+from market import app, db, cache, assets, sessions
+from market.asset_pipeline import build_assets
+from market.cache import bump_catalog_version
+from market.models import Item, User, LedgerEntry, settle_ledger
+from market.search import rebuild_search_index, search_select
+
+# 'flask items|ledger|assets|sessions ...' commands, run with FLASK_APP=market
+items_cli = AppGroup('items', help='Manage the market catalog.')
+ledger_cli = AppGroup('ledger', help='Settle and check the budget ledger.')
+assets_cli = AppGroup('assets', help='Build the static assets.')
+sessions_cli = AppGroup('sessions', help='Maintain the server-side session store.')
+
+ITEM_FIELDS = ('name', 'price', 'barcode', 'description')
+
+
+# rows of a CSV file with a header line or the lines of a JSON Lines file,
+# read lazily so the whole file never has to fit in memory. Yields (line
+# number, dict or unparsed line), see parse_row.
+def read_rows(source, file_format: str):
+    if file_format == 'csv':
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(source, start=1):
+            if line.strip():
+                yield line_number, line
+
+
+# a row of read_rows as a dict; malformed JSON and lines that are not a JSON
+# object are rejected with ValueError like any other invalid row
+def parse_row(row, file_format: str) -> dict:
+    if file_format == 'jsonl':
+        try:
+            row = json.loads(row)
+        except ValueError as error:
+            raise ValueError(f'invalid JSON: {error}')
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    return row
+
+
+# validate one input row against the Item columns and return the values to insert
+def clean_item(row: dict) -> dict:
+    missing = [field for field in ITEM_FIELDS if row.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    item = {
+        'name': str(row['name']).strip(),
+        'price': int(row['price']),
+        'barcode': str(row['barcode']).strip(),
+        'description': str(row['description']).strip(),
+    }
+    for field in ('name', 'barcode', 'description'):
+        max_length = Item.__table__.c[field].type.length
+        if len(item[field]) > max_length:
+            raise ValueError(f'{field} is longer than {max_length} characters')
+    if item['price'] < 0:
+        raise ValueError('price is negative')
+    return item
+
+
+# Remembers the name, barcode and description of every item already in the
+# database or accepted from the file, so duplicates are rejected in memory
+# instead of by a failing INSERT. Descriptions are kept as 16 byte digests.
+class UniqueItemKeys:
+
+    def __init__(self):
+        self.names = set()
+        self.barcodes = set()
+        self.descriptions = set()
+
+    @staticmethod
+    def _digest(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def load_existing(self, batch_size: int):
+        rows = db.session.execute(
+            select(Item.name, Item.barcode, Item.description).execution_options(yield_per=batch_size)
+        )
+        for name, barcode, description in rows:
+            self.names.add(name)
+            self.barcodes.add(barcode)
+            self.descriptions.add(self._digest(description))
+
+    def add(self, item: dict):
+        description = self._digest(item['description'])
+        if item['name'] in self.names:
+            raise ValueError(f"name {item['name']!r} already exists")
+        if item['barcode'] in self.barcodes:
+            raise ValueError(f"barcode {item['barcode']!r} already exists")
+        if description in self.descriptions:
+            raise ValueError('description already exists')
+
+        self.names.add(item['name'])
+        self.barcodes.add(item['barcode'])
+        self.descriptions.add(description)
+
+
+@items_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format, guessed from the file extension by default.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Rows inserted and committed per transaction.')
+@click.option('--skip-invalid', is_flag=True,
+              help='Skip invalid or duplicate rows instead of stopping.')
+def import_items(source, file_format, batch_size, skip_invalid):
+    """Import market items from a CSV or JSON Lines file.
+
+    Every row needs name, price, barcode and description. Rows are written
+    with one multi-row INSERT and one commit per batch; batches committed
+    before an error stay in the database.
+    """
+    if file_format is None:
+        file_format = 'jsonl' if Path(source.name).suffix in ('.jsonl', '.ndjson') else 'csv'
+
+    unique_keys = UniqueItemKeys()
+    unique_keys.load_existing(batch_size)
+
+    def valid_items():
+        for line_number, row in read_rows(source, file_format):
+            try:
+                item = clean_item(parse_row(row, file_format))
+                unique_keys.add(item)
+            except (ValueError, TypeError) as error:
+                if not skip_invalid:
+                    raise click.ClickException(f'line {line_number}: {error}')
+                click.echo(f'skipped line {line_number}: {error}', err=True)
+                continue
+            yield item
+
+    imported = 0
+    items = valid_items()
+    try:
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+
+            # executemany of a single INSERT, no ORM objects are created
+            db.session.execute(insert(Item.__table__), batch)
+            db.session.commit()
+            imported += len(batch)
+            click.echo(f'imported {imported} items')
+    finally:
+        if imported:
+            bump_catalog_version(cache)
+
+    click.echo(f'done, {imported} items imported')
+
+
+@items_cli.command('reindex')
+def reindex_items():
+    """Create missing catalog indexes and rebuild the search index.
+
+    Brings databases created before the search index existed up to date;
+    on SQLite the FTS5 table is re-read from the item table.
+    """
+    with db.engine.begin() as connection:
+        for index in Item.__table__.indexes:
+            index.create(connection, checkfirst=True)
+        if connection.dialect.name == 'sqlite':
+            rebuild_search_index(connection)
+    count = db.session.scalar(select(func.count()).select_from(Item))
+    click.echo(f'done, {count} items indexed')
+
+
+@items_cli.command('plans')
+def query_plans():
+    """Print the query plans of the hot catalog queries.
+
+    Run it before and after 'flask db upgrade' to see which indexes the
+    market listings, price filters and search use.
+    """
+    dialect = db.engine.dialect
+    queries = {
+        'market listing': select(Item).where(Item.owner.is_(None)).order_by(Item.id).limit(51),
+        'owned listing': select(Item).where(Item.owner == 1).order_by(Item.id).limit(51),
+        'price range': Item.catalog_select(min_price=100, max_price=500),
+    }
+    explain = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    with db.engine.connect() as connection:
+        if dialect.name != 'sqlite' or inspect(connection).has_table('item_fts'):
+            queries['search'] = search_select(['phone'], dialect.name)
+        for name, query in queries.items():
+            sql = str(query.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            click.echo(f'{name}:')
+            for row in connection.exec_driver_sql(explain + sql):
+                click.echo(f'    {row[-1]}')
+
+
+@ledger_cli.command('settle')
+@click.option('--batch-size', default=lambda: app.config['LEDGER_SETTLE_BATCH_SIZE'],
+              show_default='LEDGER_SETTLE_BATCH_SIZE', help='Entries settled per transaction.')
+def settle(batch_size):
+    """Fold all pending ledger entries into the user budgets."""
+    total = 0
+    while True:
+        settled = settle_ledger(batch_size)
+        if not settled:
+            break
+        total += settled
+    click.echo(f'{total} ledger entries settled')
+
+
+@ledger_cli.command('reconcile')
+@click.option('--backfill', is_flag=True,
+              help='Open a ledger for users created before it existed.')
+def reconcile(backfill):
+    """Check that every budget equals the sum of its settled entries."""
+    if backfill:
+        has_entries = select(LedgerEntry.id).where(LedgerEntry.user_id == User.id).exists()
+        opened = db.session.execute(
+            insert(LedgerEntry).from_select(
+                ['user_id', 'amount', 'kind', 'settled'],
+                select(User.id, User.budget, literal('opening'), literal(True)).where(~has_entries)
+            )
+        )
+        db.session.commit()
+        click.echo(f'opened the ledger of {opened.rowcount} users')
+
+    settled_totals = (
+        select(LedgerEntry.user_id, func.sum(LedgerEntry.amount).label('total'))
+        .where(LedgerEntry.settled.is_(True))
+        .group_by(LedgerEntry.user_id)
+        .subquery()
+    )
+    mismatches = db.session.execute(
+        select(User.username, User.budget, settled_totals.c.total)
+        .outerjoin(settled_totals, settled_totals.c.user_id == User.id)
+        .where(func.coalesce(settled_totals.c.total, 0) != User.budget)
+        .order_by(User.id)
+    ).all()
+
+    for username, budget, total in mismatches:
+        click.echo(f'{username}: budget {budget}, settled ledger {total or 0}', err=True)
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} budgets do not match the ledger')
+    click.echo('all budgets match the ledger')
+
+
+@assets_cli.command('build')
+def build():
+    """Minify and fingerprint the CSS, JS and images into market/dist.
+
+    Older builds are left in place, so pages cached before a deploy can still
+    load the assets they link to.
+    """
+    manifest = build_assets()
+    assets.load_manifest()
+    for name, built in sorted(manifest.items()):
+        click.echo(f'{name} -> {built}')
+    click.echo(f'done, {len(manifest)} assets built')
+
+
+@sessions_cli.command('cleanup')
+def cleanup_sessions():
+    """Delete expired sessions from the session store."""
+    if sessions is None:
+        raise click.ClickException('SESSION_BACKEND is "cookie", there is no session store')
+    click.echo(f'{sessions.store.cleanup()} expired sessions deleted')
+
+
+app.cli.add_command(items_cli)
+app.cli.add_command(ledger_cli)
+app.cli.add_command(assets_cli)
+app.cli.add_command(sessions_cli)
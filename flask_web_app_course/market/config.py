@@ -0,0 +1,179 @@
+# native imports
+import os
+from pathlib import Path
+
+# 3rd party imports
+from sqlalchemy.engine import make_url
+
+# Settings of the market app. Everything that has to be tuned per deployment
+# is read from the environment, so the same code runs under 'flask run',
+# gunicorn or uwsgi without edits. The gunicorn worker sizing lives in
+# gunicorn.conf.py, which reads the same DB_* variables.
+
+# market.db next to this package, no matter which directory the server starts in
+DEFAULT_DATABASE_URL = f"sqlite:///{Path(__file__).resolve().parent / 'market.db'}"
+
+# alembic revisions of the schema, see readme
+MIGRATIONS_DIRECTORY = str(Path(__file__).resolve().parents[1] / 'migrations')
+
+
+def env_int(name: str, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+# SQLAlchemy create_engine() options for the given database url.
+#
+# DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT are only passed when set,
+# since SQLAlchemy 1.4 gives file based SQLite a NullPool, which rejects them.
+# DB_STATEMENT_TIMEOUT (milliseconds) becomes the server side statement timeout
+# on PostgreSQL and MySQL; SQLite has none, there it bounds how long a
+# statement waits for the database lock instead.
+def engine_options(database_url: str) -> dict:
+    options = {
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+    }
+    for option, name in (('pool_size', 'DB_POOL_SIZE'),
+                         ('max_overflow', 'DB_MAX_OVERFLOW'),
+                         ('pool_timeout', 'DB_POOL_TIMEOUT')):
+        value = env_int(name)
+        if value is not None:
+            options[option] = value
+
+    timeout_ms = env_int('DB_STATEMENT_TIMEOUT')
+    if timeout_ms is not None:
+        if database_url.startswith('postgresql'):
+            options['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+        elif database_url.startswith('mysql'):
+            options['connect_args'] = {'init_command': f'SET SESSION max_execution_time={timeout_ms}'}
+        elif database_url.startswith('sqlite'):
+            options['connect_args'] = {'timeout': timeout_ms / 1000}
+    return options
+
+
+# bind key of the read-only engine in SQLALCHEMY_BINDS
+REPLICA = 'replica'
+
+# Read-only connection url for the given database url. A SQLite file is opened a
+# second time in read-only mode, which in WAL mode reads concurrently with the
+# writer; other databases need an explicit DATABASE_REPLICA_URL.
+def replica_url(database_url: str, configured_url: str = None):
+    if configured_url:
+        return configured_url
+
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        return f'sqlite:///file:{url.database}?mode=ro&uri=true'
+    return None
+
+# SQLALCHEMY_BINDS entry for the replica, with the same pool options as the
+# primary engine (string binds would not get SQLALCHEMY_ENGINE_OPTIONS)
+def replica_bind(database_url: str, configured_url: str = None) -> dict:
+    url = replica_url(database_url, configured_url)
+    if url is None:
+        return {}
+    return {REPLICA: {'url': url, **engine_options(url)}}
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SECRET_KEY = os.environ.get('SECRET_KEY', '40217598b125400a38f5a01f')
+
+    # read-only engine used inside read_replica() blocks (catalog listing, user
+    # loader), see market/database.py
+    SQLALCHEMY_BINDS = replica_bind(SQLALCHEMY_DATABASE_URI, os.environ.get('DATABASE_REPLICA_URL'))
+
+    # SQLite connection PRAGMAs: WAL journal, sync level, memory mapped I/O
+    # (bytes) and page cache (negative = KiB)
+    SQLITE_WAL = env_bool('SQLITE_WAL', True)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    SQLITE_CACHE_SIZE = env_int('SQLITE_CACHE_SIZE', -64 * 1024)
+
+    # market listing page sizes, overridable per request with ?per_page=
+    MARKET_PAGE_SIZE = env_int('MARKET_PAGE_SIZE', 50)
+    MARKET_MAX_PAGE_SIZE = env_int('MARKET_MAX_PAGE_SIZE', 200)
+    # rows fetched per round trip while /api/items streams the catalog
+    MARKET_API_BATCH_SIZE = env_int('MARKET_API_BATCH_SIZE', 1000)
+    # /api/items/search ranks at most this many matches per query
+    MARKET_SEARCH_CANDIDATES = env_int('MARKET_SEARCH_CANDIDATES', 200)
+
+    # fragment cache for rendered catalog pages ('module:Class' backend or None
+    # for the in-process LRU cache)
+    MARKET_CACHE_BACKEND = os.environ.get('MARKET_CACHE_BACKEND')
+    MARKET_CACHE_SIZE = env_int('MARKET_CACHE_SIZE', 1024)
+    # seconds a rendered catalog page is served. The in-process cache only sees
+    # this worker's trades, so with several workers a sale made elsewhere shows
+    # up here after at most this long. 0 = until the next trade, only right with
+    # one worker or a shared MARKET_CACHE_BACKEND
+    MARKET_CATALOG_TTL = env_int('MARKET_CATALOG_TTL', 5)
+
+    # seconds a logged-in user's row is served from cache by the user loader,
+    # and how many users the in-process cache keeps (apart from the fragments)
+    USER_CACHE_TTL = env_int('USER_CACHE_TTL', 5)
+    USER_CACHE_SIZE = env_int('USER_CACHE_SIZE', 10000)
+
+    # bcrypt work factor (each +1 doubles the hashing time) and the number of
+    # threads allowed to hash passwords at the same time
+    BCRYPT_LOG_ROUNDS = env_int('BCRYPT_LOG_ROUNDS', 12)
+    BCRYPT_WORKERS = env_int('BCRYPT_WORKERS', os.cpu_count() or 1)
+
+    # purchase queue ('module:Class' backend or None for in-process state):
+    # seconds to wait for an item's lock, to keep a sold item claimed and to
+    # remember the outcome of an idempotency key
+    PURCHASE_QUEUE_BACKEND = os.environ.get('PURCHASE_QUEUE_BACKEND')
+    PURCHASE_QUEUE_SIZE = env_int('PURCHASE_QUEUE_SIZE', 10000)
+    PURCHASE_LOCK_STRIPES = env_int('PURCHASE_LOCK_STRIPES', 256)
+    PURCHASE_LOCK_TIMEOUT = env_int('PURCHASE_LOCK_TIMEOUT', 2)
+    PURCHASE_CLAIM_TTL = env_int('PURCHASE_CLAIM_TTL', 10)
+    PURCHASE_RESULT_TTL = env_int('PURCHASE_RESULT_TTL', 600)
+
+    # login throttling: token buckets of failed attempts per client IP, per
+    # client IP and username, and per username from any client (burst size and
+    # attempts regained per minute, 0 turns that bucket off), in-process unless
+    # RATELIMIT_BACKEND names a shared 'module:Class' backend.
+    # PROXY_FIX_X_FOR is the number of proxies in front of the app whose
+    # X-Forwarded-For is trusted for the IP
+    LOGIN_RATE_LIMIT = env_bool('LOGIN_RATE_LIMIT', True)
+    LOGIN_IP_BURST = env_int('LOGIN_IP_BURST', 20)
+    LOGIN_IP_PER_MINUTE = env_int('LOGIN_IP_PER_MINUTE', 10)
+    LOGIN_USER_BURST = env_int('LOGIN_USER_BURST', 5)
+    LOGIN_USER_PER_MINUTE = env_int('LOGIN_USER_PER_MINUTE', 3)
+    LOGIN_ACCOUNT_BURST = env_int('LOGIN_ACCOUNT_BURST', 100)
+    LOGIN_ACCOUNT_PER_MINUTE = env_int('LOGIN_ACCOUNT_PER_MINUTE', 30)
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND')
+    RATELIMIT_SIZE = env_int('RATELIMIT_SIZE', 100000)
+    PROXY_FIX_X_FOR = env_int('PROXY_FIX_X_FOR', 0)
+
+    # ledger settlement: trades per process between automatic settlements
+    # (0 = only 'flask ledger settle') and entries settled per transaction
+    LEDGER_SETTLE_EVERY = env_int('LEDGER_SETTLE_EVERY', 100)
+    LEDGER_SETTLE_BATCH_SIZE = env_int('LEDGER_SETTLE_BATCH_SIZE', 5000)
+
+    # gzip responses of these types from this many bytes on, at this level (1-9)
+    COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 500)
+    COMPRESS_LEVEL = env_int('COMPRESS_LEVEL', 6)
+    COMPRESS_MIMETYPES = ('text/html', 'text/css', 'text/javascript', 'text/plain',
+                          'application/json', 'application/javascript')
+
+    # sessions: None stores them server side in the SQLite file SESSION_SQLITE_PATH,
+    # 'module:Class' in a shared store, 'cookie' keeps Flask's signed cookies.
+    # Expired sessions are purged every SESSION_CLEANUP_EVERY writes (0 = only
+    # 'flask sessions cleanup')
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND')
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH',
+                                         str(Path(__file__).resolve().parent / 'sessions.db'))
+    SESSION_CLEANUP_EVERY = env_int('SESSION_CLEANUP_EVERY', 1000)
+
+    # request instrumentation on /metrics (off by default) and the number of
+    # repeats of one SQL statement within a request reported as an N+1 pattern
+    MARKET_METRICS = env_bool('MARKET_METRICS', False)
+    MARKET_N_PLUS_ONE_THRESHOLD = env_int('MARKET_N_PLUS_ONE_THRESHOLD', 5)
@@ -0,0 +1,78 @@
+# native imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 3rd party imports
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+# local imports
+from market.config import REPLICA
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+# Queries issued inside this block go to the read-only engine, e.g.
+#
+#     with read_replica():
+#         items = Item.query.filter_by(owner=None).all()
+#
+# Only use it for reads that may lag behind the latest commit. Writes and
+# flushes always go to the primary engine, as does everything when no
+# replica is configured.
+@contextmanager
+def read_replica():
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+# Flask-SQLAlchemy session that routes reads inside read_replica() blocks to
+# the replica engine and everything else to the bind Flask-SQLAlchemy picks.
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _read_from_replica.get() and not self._flushing
+                and not isinstance(clause, UpdateBase)):
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# PRAGMAs applied to every new SQLite connection. The primary switches the file
+# to WAL so readers no longer wait for Item.buy commits, and NORMAL sync is
+# safe in WAL mode; the replica connections are made query-only.
+def _sqlite_pragmas(config, read_only: bool):
+    pragmas = [
+        f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE']}",
+        f"PRAGMA cache_size={config['SQLITE_CACHE_SIZE']}",
+    ]
+    if read_only:
+        pragmas.append('PRAGMA query_only=ON')
+    else:
+        if config['SQLITE_WAL']:
+            pragmas.append('PRAGMA journal_mode=WAL')
+        pragmas.append(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    return pragmas
+
+def init_database(app, db):
+    with app.app_context():
+        engines = db.engines
+
+    for key, engine in engines.items():
+        if engine.dialect.name != 'sqlite':
+            continue
+
+        pragmas = _sqlite_pragmas(app.config, read_only=key == REPLICA)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record, pragmas=pragmas):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
@@ -3,24 +3,32 @@ from market.models import User
 
 # 3rd party imports
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField
-from wtforms.validators import Length, EqualTo, Email, DataRequired, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, HiddenField
+from wtforms.validators import Length, EqualTo, Email, DataRequired
+from sqlalchemy import or_
 
 
 class RegisteredForm(FlaskForm):
     
-    # FlaskForm will validate the username via 'validate_' 'username' function name.
-    # flask validates if it sees prefix 'validate_' in function name and looks for 
-    # field 'username' in the User database.
-    def validate_username(self, username_to_check: str):
-        user = User.query.filter_by(username=username_to_check.data).first()
-        if user:
-            raise ValidationError('Username already exists! Please try a different username.')
-    
-    def validate_email(self, email_to_check: str):
-        email = User.query.filter_by(email=email_to_check.data).first()
-        if email:
-            raise ValidationError('Email address already exists! Please try a different email address.')
+    # username and email uniqueness are checked together with a single query
+    # (one round trip instead of one per field) after the field validators ran.
+    # The unique constraints still have the last word, see register_page.
+    def validate(self, extra_validators=None) -> bool:
+        valid = super().validate(extra_validators=extra_validators)
+        
+        taken = User.query.with_entities(User.username, User.email).filter(
+            or_(User.username == self.username.data, User.email == self.email.data)
+        ).limit(2).all()
+        
+        for username, email in taken:
+            if username == self.username.data:
+                self.username.errors.append('Username already exists! Please try a different username.')
+                valid = False
+            if email == self.email.data:
+                self.email.errors.append('Email address already exists! Please try a different email address.')
+                valid = False
+        
+        return valid
         
     
     username = StringField(
@@ -49,6 +57,9 @@ class LoginForm(FlaskForm):
     
 
 class PurchaseItemForm(FlaskForm):
+    # fresh per rendered market page; a resubmitted form reuses it, so the
+    # purchase queue can answer the retry without buying twice
+    idempotency_key = HiddenField()
     submit = SubmitField(label='Confirm')
     
 class SellItemForm(FlaskForm):
@@ -0,0 +1,49 @@
+# native imports
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Password hashing for the User model.
+#
+# bcrypt is CPU bound and releases the GIL while it works, so hashes are
+# computed on a small bounded thread pool: a login storm can keep at most
+# BCRYPT_WORKERS cores busy, while the other request threads stay free for
+# I/O bound pages. The work factor is read from BCRYPT_LOG_ROUNDS on every
+# call, so changing it takes effect without a restart and stored hashes with
+# another cost can be detected (needs_rehash) and upgraded on the next login.
+# Callables in 'observers' get the seconds each hash or check took, waiting for
+# a free worker included.
+class PasswordHasher:
+
+    def __init__(self, app, bcrypt):
+        self.app = app
+        self.bcrypt = bcrypt
+        self._pool = ThreadPoolExecutor(max_workers=app.config['BCRYPT_WORKERS'],
+                                        thread_name_prefix='bcrypt')
+        self.observers = []
+
+    @property
+    def rounds(self) -> int:
+        return self.app.config['BCRYPT_LOG_ROUNDS']
+
+    def _run(self, function, *args):
+        started = time.perf_counter()
+        result = self._pool.submit(function, *args).result()
+        for observer in self.observers:
+            observer(time.perf_counter() - started)
+        return result
+
+    def hash(self, plain_text_password: str) -> str:
+        return self._run(self.bcrypt.generate_password_hash,
+                         plain_text_password, self.rounds).decode('utf-8')
+
+    def check(self, password_hash: str, attempted_password: str) -> bool:
+        return self._run(self.bcrypt.check_password_hash, password_hash, attempted_password)
+
+    # bcrypt hashes look like '$2b$12$<salt+digest>', the second field is the cost
+    def needs_rehash(self, password_hash: str) -> bool:
+        try:
+            cost = int(password_hash.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+        return cost != self.rounds
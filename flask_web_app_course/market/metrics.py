@@ -0,0 +1,205 @@
+# native imports
+import threading
+import time
+from collections import Counter
+
+# 3rd party imports
+from flask import g, has_request_context, request, Response, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Opt-in request instrumentation (MARKET_METRICS=1), exposed on /metrics in the
+# Prometheus text format. Per request it records the route latency, the number
+# and time of SQL statements, template render time and bcrypt time, and it
+# flags N+1 patterns: the same SQL statement executed MARKET_N_PLUS_ONE_THRESHOLD
+# or more times while serving one request. Numbers are per process, every
+# gunicorn worker exposes its own.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(route: str) -> str:
+    return 'route="{}"'.format(route.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}  # route -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, value: float):
+        with self._lock:
+            series = self._series.setdefault(route, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for route, series in sorted(self._series.items()):
+                labels = _labels(route)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+                lines.append(f'{self.name}_sum{{{labels}}} {series[-2]}')
+                lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+
+class CounterMetric:
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._series = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, route: str, amount: int = 1):
+        with self._lock:
+            self._series[route] += amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for route, value in sorted(self._series.items()):
+                lines.append(f'{self.name}{{{_labels(route)}}} {value}')
+        return lines
+
+
+class Metrics:
+
+    def __init__(self, n_plus_one_threshold: int):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.request_seconds = Histogram(
+            'market_request_seconds', 'Request latency by route.')
+        self.db_queries = Histogram(
+            'market_request_db_queries', 'SQL statements executed per request.', COUNT_BUCKETS)
+        self.db_seconds = Histogram(
+            'market_request_db_seconds', 'Time spent in SQL statements per request.')
+        self.template_seconds = Histogram(
+            'market_request_template_seconds', 'Template render time per request.')
+        self.bcrypt_seconds = Histogram(
+            'market_request_bcrypt_seconds', 'Password hashing time per request, queueing included.')
+        self.n_plus_one = CounterMetric(
+            'market_n_plus_one_total', 'Requests that repeated one SQL statement N+1 style.')
+        self.responses = CounterMetric(
+            'market_responses_total', 'Responses sent by route.')
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.request_seconds, self.db_queries, self.db_seconds,
+                       self.template_seconds, self.bcrypt_seconds, self.n_plus_one,
+                       self.responses):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# per request accumulators, kept on flask.g
+class RequestStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+        self.statements = Counter()
+        self.template_started = None
+
+
+def _stats():
+    if has_request_context():
+        return g.get('_market_stats')
+    return None
+
+
+def init_metrics(app, db, hasher):
+    if not app.config['MARKET_METRICS']:
+        return None
+
+    metrics = Metrics(app.config['MARKET_N_PLUS_ONE_THRESHOLD'])
+
+    @app.before_request
+    def start_request_stats():
+        g._market_stats = RequestStats()
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = _stats()
+        if stats is None:
+            return response
+
+        route = request.endpoint or 'unmatched'
+        metrics.request_seconds.observe(route, time.perf_counter() - stats.started)
+        metrics.db_queries.observe(route, stats.db_queries)
+        metrics.db_seconds.observe(route, stats.db_seconds)
+        metrics.template_seconds.observe(route, stats.template_seconds)
+        if stats.bcrypt_seconds:
+            metrics.bcrypt_seconds.observe(route, stats.bcrypt_seconds)
+        metrics.responses.inc(route)
+
+        repeated = [(statement, count) for statement, count in stats.statements.items()
+                    if count >= metrics.n_plus_one_threshold]
+        if repeated:
+            metrics.n_plus_one.inc(route)
+            for statement, count in repeated:
+                app.logger.warning('N+1 query pattern in %s: executed %d times: %s',
+                                   route, count, ' '.join(statement.split())[:200])
+        return response
+
+    # SQL statements on every engine (primary and replica)
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_market_query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['_market_query_started'].pop()
+        stats = _stats()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += time.perf_counter() - started
+            stats.statements[statement] += 1
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    # template render time, signals need the blinker package
+    def template_started(sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None:
+            stats.template_started = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None and stats.template_started is not None:
+            stats.template_seconds += time.perf_counter() - stats.template_started
+            stats.template_started = None
+
+    try:
+        before_render_template.connect(template_started, app, weak=False)
+        template_rendered.connect(template_finished, app, weak=False)
+    except RuntimeError:
+        app.logger.warning('blinker is not installed, template render time is not recorded')
+
+    # password hashing time, reported by the request thread waiting for it
+    def bcrypt_finished(seconds):
+        stats = _stats()
+        if stats is not None:
+            stats.bcrypt_seconds += seconds
+
+    hasher.observers.append(bcrypt_finished)
+
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    return metrics
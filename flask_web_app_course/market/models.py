@@ -1,13 +1,43 @@
+# native imports
+import threading
+from collections import defaultdict
+from datetime import datetime
+from enum import Enum
+
 # local imports
-from market import db, bcrypt, login_manager
+from market import db, hasher, login_manager, cache, user_cache, purchase_queue
+from market.cache import bump_catalog_version
+from market.database import read_replica
+from market.template_helpers import format_money
 
 # 3rd party imports
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy import update, insert, select, func, literal, event, bindparam
+from sqlalchemy.orm import make_transient_to_detached
 # callback for the web app. If user is logged in and refreshes or browses through
-# the webpage the app keeps them logged in, therefore using different session route 
+# the webpage the app keeps them logged in, therefore using different session route.
+# The user's row is cached for USER_CACHE_TTL seconds and re-attached to the
+# session without a query; buy/sell drop the entry when the budget changes.
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_cache_key(user_id))
+    if snapshot is not None:
+        return User.from_snapshot(snapshot)
+
+    with read_replica():
+        user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.set(user_cache_key(user_id), user.snapshot(),
+                  timeout=current_app.config['USER_CACHE_TTL'])
+    return user
+
+def user_cache_key(user_id: int) -> str:
+    return f'user:{user_id}'
+
+def forget_user(user_id: int):
+    user_cache.delete(user_cache_key(user_id))
 
 # UserMixin base class has implemented some callback methods for the user
 # to browse in the wwebsite and be kept logged in. 
@@ -29,24 +59,42 @@ class User(db.Model, UserMixin):
     # 
     @password.setter
     def password(self, plain_text_password):
-        self.password_hash = bcrypt.generate_password_hash(plain_text_password).decode('utf-8')
+        self.password_hash = hasher.hash(plain_text_password)
 
     # User class method to check input password hash matches hash in db
     def check_password_correction(self, attempted_password) -> bool:
-        return bcrypt.check_password_hash(self.password_hash, attempted_password)
+        return hasher.check(self.password_hash, attempted_password)
+    
+    # re-hash a just verified password when BCRYPT_LOG_ROUNDS has changed since
+    # it was stored, so costs are upgraded (or lowered) as users log in
+    def upgrade_password_hash(self, attempted_password):
+        if hasher.needs_rehash(self.password_hash):
+            self.password = attempted_password
+            db.session.commit()
+            forget_user(self.id)
     
+    # formatted balance, memoized per value by the '|money' template filter
     @property
     def brittier_budget(self):
-        if len(str(self.budget)) >= 3:
-            return f'{self.budget:,}'
-        else:
-            return f"{self.budget}"
+        return format_money(self.balance)
         
-    def can_purchase(self, item_object):
-        return self.budget >= item_object.price
+    # plain column values (and the balance) of the user, safe to keep in any
+    # cache backend. The password hash is left out of shared caches, only the
+    # login reads it and it is loaded from the database when accessed.
+    def snapshot(self) -> dict:
+        snapshot = {column.key: getattr(self, column.key) for column in User.__table__.columns
+                    if column.key != 'password_hash'}
+        snapshot['balance'] = self.balance
+        return snapshot
     
-    def can_sell(self, item_object):
-        return item_object in self.items
+    # rebuild a user from snapshot() and attach it to the session as if it had
+    # just been loaded, without emitting a SELECT. Relationships such as
+    # 'items' stay unloaded and are only queried if they are actually used.
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> 'User':
+        user = cls(**snapshot)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
 
 
 # create databse class
@@ -59,23 +107,241 @@ class Item(db.Model):
     price = db.Column(db.Integer(), nullable=False)
     barcode = db.Column(db.String(length=12), nullable=False, unique=True)
     description = db.Column(db.String(length=1024), nullable=False, unique=True)
-    owner = db.Column(db.Integer(), db.ForeignKey('user.id'))
+    # indexed, both market listings filter on it
+    owner = db.Column(db.Integer(), db.ForeignKey('user.id'), index=True)
+    
+    # serves price range filters on the market (owner IS NULL) and per owner
+    __table_args__ = (db.Index('ix_item_owner_price', 'owner', 'price'),)
     
     # override the naming convention of the table item
     def __repr__(self):
         return f'Item {self.name}'
     
-    def buy(self, user):
-        # current_user built-in method accesses logged-in user User object.
-        # assigning user id to the Items owner field
-        self.owner = user.id
+    # primary key lookup; served from the session identity map when the item
+    # was already loaded in this request, otherwise a single PK query
+    @classmethod
+    def lookup(cls, item_id: int):
+        return db.session.get(cls, item_id)
+    
+    # public fields of the item, served by the item detail API
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'price': self.price,
+            'barcode': self.barcode,
+            'description': self.description,
+        }
+    
+    # keyset pagination over the items of one owner (None = on the market).
+    # Seeks past 'after_id' on the primary key instead of using OFFSET, so every
+    # page costs the same no matter how deep into the catalog it is. Returns the
+    # page and the cursor of the next page (None on the last page).
+    @classmethod
+    def keyset_page(cls, owner, after_id=None, limit=50):
+        query = cls.query.filter_by(owner=owner)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        
+        # fetch one extra row to find out whether another page exists
+        rows = query.order_by(cls.id).limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    
+    # Core select of the to_dict() columns for the catalog API, in id order so
+    # a client can resume after the last id it received. Returns plain rows,
+    # no ORM objects are built or tracked while a large catalog is streamed.
+    @classmethod
+    def catalog_select(cls, owner=None, min_price=None, max_price=None, after_id=None):
+        query = select(cls.id, cls.name, cls.price, cls.barcode, cls.description)
+        query = query.where(cls.owner.is_(None) if owner is None else cls.owner == owner)
+        if min_price is not None:
+            query = query.where(cls.price >= min_price)
+        if max_price is not None:
+            query = query.where(cls.price <= max_price)
+        if after_id is not None:
+            query = query.where(cls.id > after_id)
+        return query.order_by(cls.id)
+    
+    def buy(self, user) -> 'TradeResult':
+        # claim the item only if nobody owns it yet. The claim and the charge
+        # run in one transaction, so two concurrent requests can never sell
+        # the same item twice or push a balance below zero.
+        claimed = db.session.execute(
+            update(Item)
+            .where(Item.id == self.id, Item.owner.is_(None))
+            .values(owner=user.id)
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount != 1:
+            db.session.rollback()
+            return TradeResult.UNAVAILABLE
+
+        # Lock the buyer's row with a no-op UPDATE before checking the balance.
+        # The check below is a plain read, at READ COMMITTED (PostgreSQL,
+        # MySQL) two purchases by the same user could both pass it and
+        # overdraw the balance; now the second waits here until the first has
+        # committed its ledger entry. SQLite already serializes all writers.
+        db.session.execute(
+            update(User)
+            .where(User.id == user.id)
+            .values(budget=User.budget)
+            .execution_options(synchronize_session=False)
+        )
         
-        # deduct price of the item from user's budegt
-        user.budget -= self.price
+        # charge the user by appending to the ledger, only if their balance
+        # (settled budget + pending entries) covers the price. The budget is
+        # not changed, settle_ledger() folds the entries into it later.
+        available = select(User.balance).where(User.id == user.id).scalar_subquery()
+        charged = db.session.execute(
+            insert(LedgerEntry).from_select(
+                ['user_id', 'item_id', 'amount', 'kind'],
+                select(literal(user.id), literal(self.id), literal(-self.price), literal('buy'))
+                .where(available >= self.price)
+            )
+        )
+        if charged.rowcount != 1:
+            db.session.rollback()
+            return TradeResult.INSUFFICIENT_FUNDS
 
+        # commit expires both objects, so the new owner/balance are reloaded
         db.session.commit()
+        settle_ledger_periodically()
         
-    def sell(self, user):
-        self.owner = None
-        user.budget += self.price
-        db.session.commit()
\ No newline at end of file
+        # the item left the market, cached catalog pages and the buyer's
+        # cached budget are stale now
+        bump_catalog_version(cache)
+        forget_user(user.id)
+        return TradeResult.SUCCESS
+        
+    def sell(self, user) -> 'TradeResult':
+        # release the item only if this user still owns it
+        released = db.session.execute(
+            update(Item)
+            .where(Item.id == self.id, Item.owner == user.id)
+            .values(owner=None)
+            .execution_options(synchronize_session=False)
+        )
+        if released.rowcount != 1:
+            db.session.rollback()
+            return TradeResult.NOT_OWNER
+
+        db.session.execute(
+            insert(LedgerEntry).values(user_id=user.id, item_id=self.id,
+                                       amount=self.price, kind='sell')
+        )
+        db.session.commit()
+        settle_ledger_periodically()
+        
+        # the item is back on the market
+        bump_catalog_version(cache)
+        forget_user(user.id)
+        purchase_queue.release(self.id)
+        return TradeResult.SUCCESS
+
+
+# Append-only record of every change to a user's money. Item.buy and Item.sell
+# only add entries; User.budget holds the settled balance and is brought up to
+# date in batches by settle_ledger(). Each user starts with an 'opening' entry
+# for their initial budget, so the settled entries always add up to the budget
+# (checked by 'flask ledger reconcile').
+class LedgerEntry(db.Model):
+    id = db.Column(db.Integer(), primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey('user.id'), nullable=False)
+    item_id = db.Column(db.Integer(), db.ForeignKey('item.id'))
+    amount = db.Column(db.Integer(), nullable=False) # negative for purchases
+    kind = db.Column(db.String(length=10), nullable=False) # opening, buy or sell
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+    settled = db.Column(db.Boolean(), nullable=False, default=False)
+    
+    # serves the pending balance of a user and settlement
+    __table_args__ = (db.Index('ix_ledger_entry_user_id_settled', 'user_id', 'settled'),)
+    
+    def __repr__(self):
+        return f'LedgerEntry {self.kind} {self.amount} user {self.user_id}'
+
+
+# What a user can spend: the settled budget plus their unsettled entries. It is
+# a correlated subquery loaded in the same SELECT as the user row.
+User.balance = db.column_property(
+    User.budget + select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+    .where(LedgerEntry.user_id == User.id, LedgerEntry.settled.is_(False))
+    .correlate_except(LedgerEntry)
+    .scalar_subquery()
+)
+
+# every new user opens their ledger with the initial budget, in the same flush
+@event.listens_for(User, 'after_insert')
+def open_ledger(mapper, connection, user):
+    connection.execute(insert(LedgerEntry.__table__).values(
+        user_id=user.id, amount=user.budget, kind='opening',
+        settled=True, created_at=datetime.utcnow()))
+
+
+# Fold up to 'batch_size' pending ledger entries into User.budget in one
+# transaction and mark them settled. The entries are selected and locked
+# first (FOR UPDATE, SQLite locks the whole file on the first write instead),
+# then exactly those amounts are added to the budgets and exactly those ids are
+# marked settled. An entry committed meanwhile is left for the next run, so
+# even at READ COMMITTED nothing is counted twice or skipped.
+# Returns the number of entries settled.
+def settle_ledger(batch_size: int) -> int:
+    entries = db.session.execute(
+        select(LedgerEntry.id, LedgerEntry.user_id, LedgerEntry.amount)
+        .where(LedgerEntry.settled.is_(False))
+        .order_by(LedgerEntry.id)
+        .limit(batch_size)
+        .with_for_update()
+    ).all()
+    if not entries:
+        db.session.rollback()
+        return 0
+
+    totals = defaultdict(int)
+    for _, user_id, amount in entries:
+        totals[user_id] += amount
+
+    users, ledger = User.__table__, LedgerEntry.__table__
+    # in id order, so concurrent settlements lock users in the same order
+    db.session.execute(
+        update(users).where(users.c.id == bindparam('user'))
+        .values(budget=users.c.budget + bindparam('amount')),
+        [{'user': user_id, 'amount': totals[user_id]} for user_id in sorted(totals)]
+    )
+    db.session.execute(
+        update(ledger).where(ledger.c.id == bindparam('entry')).values(settled=True),
+        [{'entry': entry_id} for entry_id, _, _ in entries]
+    )
+    db.session.commit()
+    return len(entries)
+
+# settle after every LEDGER_SETTLE_EVERY trades of this process (0 = only
+# through 'flask ledger settle')
+_trades_since_settlement = 0
+_trades_lock = threading.Lock()
+
+def settle_ledger_periodically():
+    global _trades_since_settlement
+    every = current_app.config['LEDGER_SETTLE_EVERY']
+    if not every:
+        return
+
+    with _trades_lock:
+        _trades_since_settlement += 1
+        due = _trades_since_settlement >= every
+        if due:
+            _trades_since_settlement = 0
+    if due:
+        settle_ledger(current_app.config['LEDGER_SETTLE_BATCH_SIZE'])
+
+
+# outcome of Item.buy / Item.sell so routes can report what happened
+class TradeResult(Enum):
+    SUCCESS = 'success'
+    UNAVAILABLE = 'unavailable'
+    INSUFFICIENT_FUNDS = 'insufficient_funds'
+    NOT_OWNER = 'not_owner'
+    BUSY = 'busy'
+
+    def __bool__(self):
+        return self is TradeResult.SUCCESS
@@ -0,0 +1,127 @@
+# native imports
+import threading
+from contextlib import contextmanager
+
+# 3rd party imports
+from werkzeug.utils import import_string
+
+# local imports
+from market.cache import LocalCache
+
+
+# In-process state of the purchase queue. A shared backend (e.g. Redis locks
+# and keys) only has to provide the same methods to serialize purchases across
+# workers, see PURCHASE_QUEUE_BACKEND.
+class LocalPurchaseBackend:
+
+    def __init__(self, app):
+        # striped locks: bounded memory, one lock serves every item_id % stripes
+        self._locks = [threading.Lock() for _ in range(app.config['PURCHASE_LOCK_STRIPES'])]
+        self._claims = LocalCache(max_entries=app.config['PURCHASE_QUEUE_SIZE'])
+        self._results = LocalCache(max_entries=app.config['PURCHASE_QUEUE_SIZE'])
+
+    @contextmanager
+    def lock(self, item_id: int, timeout: float):
+        lock = self._locks[item_id % len(self._locks)]
+        acquired = lock.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+    def is_claimed(self, item_id: int) -> bool:
+        return self._claims.get(item_id) is not None
+
+    def claim(self, item_id: int, timeout: float):
+        self._claims.set(item_id, True, timeout=timeout)
+
+    def release(self, item_id: int):
+        self._claims.delete(item_id)
+
+    def get_result(self, key: str):
+        return self._results.get(key)
+
+    def set_result(self, key: str, outcome: tuple, timeout: float):
+        self._results.set(key, outcome, timeout=timeout)
+
+
+# Serializes purchases per item in front of Item.buy.
+#
+# When a popular item drops, only the first buyer reaches the database: the
+# winner marks the item as claimed and everyone queued behind it, or arriving
+# later, is turned away from memory. Claims expire after PURCHASE_CLAIM_TTL
+# seconds, so a sale made by another worker can at most hide the item for
+# that long; Item.buy stays the authority on ownership either way.
+#
+# Outcomes are remembered per (user, item, idempotency key), so a retried or
+# double-submitted purchase form gets the first answer back without redoing
+# any work.
+class PurchaseQueue:
+
+    def __init__(self, app):
+        backend = app.config['PURCHASE_QUEUE_BACKEND']
+        if backend is None:
+            backend = LocalPurchaseBackend
+        elif isinstance(backend, str):
+            backend = import_string(backend)
+
+        self.backend = backend(app)
+        self.app = app
+
+    # Buy the item with the given id for the user. Returns the TradeResult and
+    # the item's name and price for the flash message, or None when no such
+    # item exists.
+    def purchase(self, item_id: int, user, idempotency_key: str = None):
+        # imported here, the models import the app package this module is part of
+        from market.models import Item, TradeResult
+
+        config = self.app.config
+        result_key = f'{user.id}:{item_id}:{idempotency_key}' if idempotency_key else None
+
+        def remembered():
+            if result_key is None:
+                return None
+            outcome = self.backend.get_result(result_key)
+            if outcome is None:
+                return None
+            result, name, price = outcome
+            return TradeResult(result), name, price
+
+        outcome = remembered()
+        if outcome is not None:
+            return outcome
+
+        # somebody already bought it, reject without waiting or querying
+        if self.backend.is_claimed(item_id):
+            return TradeResult.UNAVAILABLE, None, None
+
+        with self.backend.lock(item_id, timeout=config['PURCHASE_LOCK_TIMEOUT']) as acquired:
+            if not acquired:
+                return TradeResult.BUSY, None, None
+
+            # a duplicate of this request or the winner may have finished
+            # while we were queued
+            outcome = remembered()
+            if outcome is not None:
+                return outcome
+            if self.backend.is_claimed(item_id):
+                return TradeResult.UNAVAILABLE, None, None
+
+            item = Item.lookup(item_id)
+            if item is None:
+                return None
+
+            result = item.buy(user=user)
+            if result in (TradeResult.SUCCESS, TradeResult.UNAVAILABLE):
+                self.backend.claim(item_id, timeout=config['PURCHASE_CLAIM_TTL'])
+
+            outcome = (result, item.name, item.price)
+            if result_key is not None:
+                self.backend.set_result(result_key, (result.value, item.name, item.price),
+                                        timeout=config['PURCHASE_RESULT_TTL'])
+            return outcome
+
+    # the item is on the market again (Item.sell)
+    def release(self, item_id: int):
+        self.backend.release(item_id)
@@ -0,0 +1,99 @@
+# native imports
+import threading
+import time
+from collections import OrderedDict
+
+# 3rd party imports
+from werkzeug.utils import import_string
+
+
+# In-process token buckets, at most RATELIMIT_SIZE of them (least recently used
+# ones are dropped, which only makes the limiter more lenient). A shared
+# backend (e.g. a Redis script over a hash per key) only has to provide
+# wait() and consume() to enforce the limits across workers, see
+# RATELIMIT_BACKEND.
+class LocalRateLimitBackend:
+
+    def __init__(self, app):
+        self.max_entries = app.config['RATELIMIT_SIZE']
+        self._buckets = OrderedDict()  # key -> (tokens, updated at)
+        self._lock = threading.Lock()
+
+    # Seconds until the bucket of 'key', which holds up to 'capacity' tokens
+    # and regains 'rate' tokens per second, has a token. 0 when it has one now.
+    def wait(self, key: str, capacity: int, rate: float) -> float:
+        return self._take(key, capacity, rate, 0)
+
+    # Take one token from the bucket of 'key'. Returns 0 when the token was
+    # taken, otherwise the seconds until one is available.
+    def consume(self, key: str, capacity: int, rate: float) -> float:
+        return self._take(key, capacity, rate, 1)
+
+    def _take(self, key: str, capacity: int, rate: float, cost: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= cost
+            else:
+                wait = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Throttles failed logins per client IP, per client and username, and per
+# username.
+#
+# Only failed attempts take tokens, so users who type their password right are
+# never throttled. Every attempt checks the buckets before the user is looked
+# up and the password is checked, so once a client has used up its failures a
+# flood of guesses is turned away without a query or a bcrypt hash.
+#
+# The IP bucket stops one client from trying many accounts, the client and
+# username bucket stops it from hammering one account. Neither touches what
+# other clients may do, so one client cannot lock a user out. Only the much
+# larger per-username bucket is shared, it stops many clients (a botnet) from
+# trying one account. Limits are read from the config on every call,
+# LOGIN_RATE_LIMIT=0 switches throttling off, a *_PER_MINUTE of 0 that bucket.
+class RateLimiter:
+
+    def __init__(self, app):
+        backend = app.config['RATELIMIT_BACKEND']
+        if backend is None:
+            backend = LocalRateLimitBackend
+        elif isinstance(backend, str):
+            backend = import_string(backend)
+
+        self.backend = backend(app)
+        self.app = app
+
+    # (key, burst, tokens regained per second) of the buckets an attempt counts against
+    def _buckets(self, remote_addr: str, username: str) -> list:
+        config = self.app.config
+        if not config['LOGIN_RATE_LIMIT']:
+            return []
+
+        username = username.strip().lower()
+        buckets = (
+            (f'login:ip:{remote_addr}', config['LOGIN_IP_BURST'], config['LOGIN_IP_PER_MINUTE']),
+            (f'login:ip-user:{remote_addr}:{username}', config['LOGIN_USER_BURST'],
+             config['LOGIN_USER_PER_MINUTE']),
+            (f'login:user:{username}', config['LOGIN_ACCOUNT_BURST'], config['LOGIN_ACCOUNT_PER_MINUTE']),
+        )
+        return [(key, burst, per_minute / 60) for key, burst, per_minute in buckets if per_minute > 0]
+
+    # Returns 0 when the attempt may go ahead, otherwise the seconds the client
+    # should wait before trying again.
+    def login_attempt(self, remote_addr: str, username: str) -> float:
+        waits = [self.backend.wait(*bucket) for bucket in self._buckets(remote_addr, username)]
+        return max(waits, default=0.0)
+
+    # charge a wrong username or password to every bucket of the attempt
+    def login_failed(self, remote_addr: str, username: str):
+        for bucket in self._buckets(remote_addr, username):
+            self.backend.consume(*bucket)
@@ -0,0 +1,76 @@
+# native imports
+import gzip
+import hashlib
+import time
+
+# 3rd party imports
+from flask import current_app, request, session, make_response
+
+# Response compression and conditional GETs.
+#
+# HTML, JSON, CSS and JS responses of at least COMPRESS_MIN_SIZE bytes are
+# gzipped for clients that accept it. GET responses without a validator get a
+# weak ETag over their body, so an unchanged page costs the client a 304 but
+# the server still renders it. Views that can tell up front whether their
+# output changed (the market page, see routes.py) compute the ETag from what
+# the page is made of and answer with not_modified() before doing any work.
+
+# Flask-WTF's default token lifetime
+CSRF_TIME_LIMIT = 3600
+
+
+# Weak ETag of a page derived from the values it is rendered from.
+#
+# Forms embed a CSRF token that expires after WTF_CSRF_TIME_LIMIT seconds, so
+# the tag also changes every half of that: a page confirmed with a 304 carries
+# a token at most half the limit old.
+def page_etag(*parts) -> str:
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', CSRF_TIME_LIMIT) or CSRF_TIME_LIMIT
+    bucket = int(time.time() // max(1, time_limit // 2))
+    key = ':'.join(str(part) for part in (*parts, bucket))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Pending flash messages are shown once by the next page, such a page must be
+# rendered for real and never answered from the client's copy.
+def has_pending_flashes() -> bool:
+    return bool(session.get('_flashes'))
+
+
+# A 304 response when the client already has the page with this ETag.
+def not_modified(etag: str, cache_control: str = 'private, no-cache'):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def init_responses(app):
+    min_size = app.config['COMPRESS_MIN_SIZE']
+    level = app.config['COMPRESS_LEVEL']
+    mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+
+    @app.after_request
+    def conditional_and_compressed(response):
+        # streamed bodies are neither hashed nor buffered for compression
+        if response.is_streamed or response.direct_passthrough:
+            return response
+
+        if request.method in ('GET', 'HEAD') and response.status_code == 200 \
+                and 'ETag' not in response.headers:
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+
+        if response.status_code != 200 or response.mimetype not in mimetypes \
+                or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if 'gzip' not in request.accept_encodings or (response.content_length or 0) < min_size:
+            return response
+
+        response.set_data(gzip.compress(response.get_data(), level))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
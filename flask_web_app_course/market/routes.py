@@ -1,14 +1,35 @@
+# native imports
+import json
+import math
+import time
+from uuid import uuid4
+
 # local imports
-from market import app, db
-from market.models import Item, User
+from market import app, db, cache, purchase_queue, limiter
+from market.cache import catalog_version
+from market.database import read_replica
+from market.template_helpers import format_money
+from market.responses import page_etag, has_pending_flashes, not_modified
+from market.search import search_terms, search_select
+from market.models import Item, User, TradeResult
 from market.forms import RegisteredForm, LoginForm, PurchaseItemForm, SellItemForm
 
 # 3rd party imports
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, jsonify, abort, make_response, Response, stream_with_context
+from markupsafe import Markup
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError
 
 
 # functions
+# Number of the MARKET_CATALOG_TTL window we are in. Part of the market page
+# ETag, so a client revalidating gets a fresh page whenever the cached catalog
+# fragment may have expired, even if this worker's catalog version has not moved.
+def catalog_age() -> int:
+    ttl = app.config['MARKET_CATALOG_TTL']
+    return int(time.time() // ttl) if ttl else 0
+
+
 @app.route("/")
 @app.route("/home")
 def home_page():
@@ -23,45 +44,162 @@ def market_page():
     
     # if data is sent from HTML to the server (aka the "POST" method)
     if request.method == "POST":
-        # Purchase Item Logic
+        # since we added hidden <input> tags to our forms in items_modals.html and
+        # owned_items_modals.html we can catch the value="{{ item.id }}" of the
+        # submitted item. Only one of the two forms is posted per request.
+        purchased_item_id = request.form.get('purchased_item', type=int)
+        sold_item_id = request.form.get('sold_item', type=int)
         
-        # since we added hidden <input> tag to our form in items_modals.html
-        # we can catch the value="{{ item.name }}" of the 'purchased_id' item
-        purchased_item = request.form.get('purchased_item')
-        
-        # now we have the name of the item and query its data from the db
-        p_item_object = Item.query.filter_by(name=purchased_item).first()
-        
-        if p_item_object: 
-            if current_user.can_purchase(item_object=p_item_object):
-                p_item_object.buy(user=current_user)
-                flash(f"Congratulations! You purchased {purchased_item} for ${p_item_object.price}.", category='success')
-            else:
-                flash(f"Unfortunately, you don't have enough funds to purchase {p_item_object.name}.", category='danger')
+        # Purchase Item Logic
+        if purchased_item_id is not None:
+            # the queue serializes buyers of the same item and answers losers
+            # and retried forms without going to the database
+            purchase = purchase_queue.purchase(purchased_item_id, current_user,
+                                               idempotency_key=purchase_form.idempotency_key.data)
+            
+            if purchase: 
+                result, item_name, item_price = purchase
+                if result is TradeResult.SUCCESS:
+                    flash(f"Congratulations! You purchased {item_name} for ${format_money(item_price)}.", category='success')
+                elif result is TradeResult.INSUFFICIENT_FUNDS:
+                    flash(f"Unfortunately, you don't have enough funds to purchase {item_name}.", category='danger')
+                elif result is TradeResult.BUSY:
+                    flash("The market is busy right now, please try again.", category='danger')
+                else:
+                    flash("Unfortunately, this item has already been purchased.", category='danger')
         
         # Sell Item Logic
-        sold_item = request.form.get('sold_item')
-        s_item_object = Item.query.filter_by(name=sold_item).first()
-        
-        if s_item_object:
-            if current_user.can_sell(s_item_object):
-                s_item_object.sell(current_user)
-                flash(f"Congratulations! You sold {sold_item} for ${s_item_object.price}.", category='success')
-            else:
-                flash(f"Something went wrong with selling {s_item_object.name} back to market!.", category='danger')
+        elif sold_item_id is not None:
+            s_item_object = Item.lookup(sold_item_id)
+            
+            if s_item_object:
+                if s_item_object.sell(current_user):
+                    flash(f"Congratulations! You sold {s_item_object.name} for ${format_money(s_item_object.price)}.", category='success')
+                else:
+                    flash(f"Something went wrong with selling {s_item_object.name} back to market!.", category='danger')
         
         # end the 'POST' request with return statement
         return redirect(url_for('market_page'))
             
     if request.method == "GET":
-        # only display items that have no owners, aka bought items will disappear per user
-        items = Item.query.filter_by(owner=None)
+        # both listings are paginated with keyset cursors: ?after= for the market
+        # and ?owned_after= for the owned items, sharing the ?per_page= size
+        per_page = request.args.get('per_page', app.config['MARKET_PAGE_SIZE'], type=int)
+        per_page = max(1, min(per_page, app.config['MARKET_MAX_PAGE_SIZE']))
+        after = request.args.get('after', type=int)
+        owned_after = request.args.get('owned_after', type=int)
+        
+        # The page only changes with the catalog (every buy/sell bumps its
+        # version), the user's budget and the cursors, so a client that has
+        # this version gets a 304 without any query or render. Pages showing
+        # flash messages are always rendered.
+        etag = None
+        if not has_pending_flashes():
+            etag = page_etag('market', catalog_version(cache), catalog_age(), current_user.id,
+                             current_user.balance, per_page, after, owned_after)
+            unchanged = not_modified(etag)
+            if unchanged is not None:
+                return unchanged
+        
+        purchase_form.idempotency_key.data = uuid4().hex
+        
+        # only display items that have no owners, aka bought items will disappear per user.
+        # The table is the same for everyone until the next buy/sell, so it is
+        # rendered once per catalog version and page and then served from cache.
+        catalog_key = f'catalog:{catalog_version(cache)}:{after}:{per_page}'
+        catalog_html = cache.get(catalog_key)
+        if catalog_html is None:
+            with read_replica():
+                items, next_after = Item.keyset_page(owner=None, after_id=after, limit=per_page)
+            catalog_html = render_template('includes/catalog_table.html', items=items,
+                                           per_page=per_page, after=after, next_after=next_after)
+            cache.set(catalog_key, catalog_html, timeout=app.config['MARKET_CATALOG_TTL'])
         
         # query user items
-        owned_items = Item.query.filter_by(owner=current_user.id)
+        owned_items, next_owned_after = Item.keyset_page(
+            owner=current_user.id, after_id=owned_after, limit=per_page)
         
-        return render_template('market.html', items=items, purchase_form=purchase_form, 
-                               owned_items=owned_items, selling_form=selling_form)
+        response = make_response(render_template(
+            'market.html', catalog_html=Markup(catalog_html),
+            purchase_form=purchase_form, owned_items=owned_items,
+            selling_form=selling_form, per_page=per_page, after=after,
+            owned_after=owned_after, next_owned_after=next_owned_after))
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+@app.route('/api/items/<int:item_id>')
+@login_required
+def item_detail_api(item_id):
+    # details for the shared item modals on the market page, fetched on open
+    item = Item.lookup(item_id)
+    if item is None:
+        abort(404)
+    
+    return jsonify(item.to_dict())
+
+@app.route('/api/items/search')
+@login_required
+def item_search_api():
+    # ?q= words matched as prefixes against item names and descriptions, best
+    # matches first, with the owner and price filters of /api/items and
+    # ?limit= capped at MARKET_MAX_PAGE_SIZE
+    terms = search_terms(request.args.get('q'))
+    if not terms:
+        return jsonify([])
+    
+    limit = request.args.get('limit', app.config['MARKET_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MARKET_MAX_PAGE_SIZE']))
+    with read_replica():
+        dialect = db.session.get_bind().dialect.name
+        query = search_select(terms, dialect,
+                              owner=request.args.get('owner', type=int),
+                              min_price=request.args.get('min_price', type=int),
+                              max_price=request.args.get('max_price', type=int),
+                              limit=limit,
+                              candidates=app.config['MARKET_SEARCH_CANDIDATES'])
+        rows = db.session.execute(query).all()
+    
+    return jsonify([row._asdict() for row in rows])
+
+@app.route('/api/items')
+@login_required
+def items_api():
+    # The catalog for other services: items on the market (or of ?owner=<user
+    # id>), optionally within ?min_price= / ?max_price= and after ?after=<id>.
+    # Streamed as a JSON array, or one object per line with ?format=ndjson or
+    # 'Accept: application/x-ndjson'. Rows are fetched yield_per at a time
+    # from one cursor, memory stays flat however large the catalog is.
+    query = Item.catalog_select(owner=request.args.get('owner', type=int),
+                                min_price=request.args.get('min_price', type=int),
+                                max_price=request.args.get('max_price', type=int),
+                                after_id=request.args.get('after', type=int))
+    query = query.execution_options(yield_per=app.config['MARKET_API_BATCH_SIZE'])
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    
+    # one chunk per fetched batch rather than per row, fewer writes to the socket
+    def batches():
+        with read_replica():
+            result = db.session.execute(query)
+        for partition in result.partitions():
+            yield [json.dumps(row._asdict(), separators=(',', ':')) for row in partition]
+    
+    def ndjson_lines():
+        for batch in batches():
+            yield '\n'.join(batch) + '\n'
+    
+    def json_array():
+        separator = '['
+        for batch in batches():
+            yield separator + ','.join(batch)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+    
+    body = ndjson_lines() if ndjson else json_array()
+    return Response(stream_with_context(body),
+                    mimetype='application/x-ndjson' if ndjson else 'application/json')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register_page():
@@ -74,7 +212,13 @@ def register_page():
                               password=form.password1.data)
         # send data to database
         db.session.add(user_to_create)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent sign-up took the username or email after validation
+            db.session.rollback()
+            flash('Username or email address already exists! Please try again.', category='danger')
+            return render_template('register.html', form=form)
 
         # when entered username and password are correct log in
         login_user(user_to_create)
@@ -97,11 +241,23 @@ def register_page():
 def login_page():
     form = LoginForm()
     if form.validate_on_submit():
+        # throttled before the user query and the bcrypt check, so attempts
+        # past the limit of failures cost neither
+        retry_after = limiter.login_attempt(request.remote_addr, form.username.data)
+        if retry_after:
+            retry_after = math.ceil(retry_after)
+            flash(f'Too many login attempts! Please try again in {retry_after} seconds.', category='danger')
+            response = make_response(render_template('login.html', form=form), 429)
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        
         # if user excists. first() is used to get the object from query
         attempted_user = User.query.filter_by(username=form.username.data).first()
         if attempted_user and attempted_user.check_password_correction(
             attempted_password=form.password.data
         ):
+            attempted_user.upgrade_password_hash(attempted_password=form.password.data)
+            
             # when entered username and password are correct log in
             login_user(attempted_user)
             flash(f'Success! You are logged in as {attempted_user.username}', category='success')
@@ -109,6 +265,7 @@ def login_page():
             return redirect(url_for('market_page'))
         
         else:
+            limiter.login_failed(request.remote_addr, form.username.data)
             flash('Username and password do not match! Please try again!', category='danger')
         
     return render_template('login.html', form=form)
@@ -0,0 +1,93 @@
+# native imports
+import re
+
+# 3rd party imports
+from sqlalchemy import DDL, event, select, or_, func, table, column
+
+# local imports
+from market.models import Item
+
+# Full text search over item names and descriptions.
+#
+# On SQLite the item table gets an external content FTS5 index, item_fts: it
+# stores only the tokens and reads the text from item by rowid. Triggers keep
+# it in sync with inserts, deletes and name/description edits; buying and
+# selling only touch item.owner and never reach the index. Tables created by
+# create_all() get it automatically, existing databases with
+# 'flask items reindex'. Other databases fall back to LIKE filters.
+
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "name, description, content='item', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF name, description ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO item_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+FTS_REBUILD = "INSERT INTO item_fts (item_fts) VALUES ('rebuild')"
+
+# search terms beyond this many are ignored
+MAX_TERMS = 8
+
+item_fts = table('item_fts', column('rowid'), column('rank'), column('item_fts'))
+
+for statement in FTS_DDL:
+    event.listen(Item.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+
+# create the index and triggers if missing, then re-read every item into it
+def rebuild_search_index(connection):
+    for statement in FTS_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(FTS_REBUILD)
+
+
+# Words of the user's query. Only word characters are kept, so FTS5 operators,
+# quotes and column filters typed by a user can never reach MATCH.
+def search_terms(text: str) -> list:
+    return re.findall(r'\w+', text or '')[:MAX_TERMS]
+
+
+# every term must match, as a word prefix: 'sil pho' finds 'Silver Phone'
+def fts_query(terms: list) -> str:
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+# Select of the to_dict() columns of the items matching every term, with the
+# owner and price filters of Item.catalog_select.
+#
+# bm25 ranking costs a score per match, which is hundreds of milliseconds for
+# a word shared by 200k items. Only the first 'candidates' matches in id
+# order are ranked, the best 'limit' of those come first: exact ranking for
+# selective queries, bounded time for broad ones.
+def search_select(terms: list, dialect: str, owner=None, min_price=None, max_price=None,
+                  limit=20, candidates=200):
+    columns = (Item.id, Item.name, Item.price, Item.barcode, Item.description)
+    filters = [Item.owner.is_(None) if owner is None else Item.owner == owner]
+    if min_price is not None:
+        filters.append(Item.price >= min_price)
+    if max_price is not None:
+        filters.append(Item.price <= max_price)
+
+    if dialect != 'sqlite':
+        return select(*columns).where(*filters, *(
+            or_(func.lower(Item.name).contains(term.lower(), autoescape=True),
+                func.lower(Item.description).contains(term.lower(), autoescape=True))
+            for term in terms
+        )).order_by(Item.id).limit(limit)
+
+    matches = (select(*columns, item_fts.c.rank.label('rank'))
+               .join_from(item_fts, Item, Item.id == item_fts.c.rowid)
+               .where(item_fts.c.item_fts.match(fts_query(terms)), *filters)
+               .order_by(item_fts.c.rowid)
+               .limit(max(limit, candidates))
+               .subquery())
+    return (select(*(matches.c[column.key] for column in columns))
+            .order_by(matches.c.rank)
+            .limit(limit))
@@ -0,0 +1,242 @@
+# native imports
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+
+# 3rd party imports
+from flask import session
+from flask.sessions import SessionInterface, SessionMixin
+from flask_login import user_logged_in
+from itsdangerous import BadSignature, Signer
+from werkzeug.utils import import_string
+
+# Server-side sessions.
+#
+# The session cookie only carries a signed random session id; the data (login
+# state, CSRF token, flashed messages) is pickled into a store keyed by that
+# id. The cookie stays the same size however many flashes are queued, and it is
+# only re-signed when the session is created or its expiry refreshed.
+#
+# Sessions load lazily: the store is read the first time a request looks into
+# the session, so requests that never do (static assets, /metrics, anonymous
+# visitors without a cookie) cost no lookup and no unpickling. Unmodified
+# sessions are not written back, only their expiry is extended once half of
+# PERMANENT_SESSION_LIFETIME has passed.
+#
+# Logging in moves the session to a new id and drops the old one, so an id
+# planted in a victim's browser before they log in (session fixation) never
+# becomes an authenticated session.
+
+SID_SALT = 'market-session'
+
+
+# Session stored in the local SQLite file SESSION_SQLITE_PATH. A shared store
+# (e.g. Redis keys with a TTL) only has to provide the same methods for several
+# hosts to share sessions, see SESSION_BACKEND.
+class SQLiteSessionStore:
+
+    def __init__(self, app):
+        self.path = app.config['SESSION_SQLITE_PATH']
+        self._local = threading.local()
+
+    # one connection per thread, sqlite3 connections must not be shared
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS session ('
+                               'sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)')
+            self._local.connection = connection
+        return connection
+
+    # (data, expiry timestamp) or None for unknown and expired sessions
+    def get(self, sid: str):
+        return self.connection.execute(
+            'SELECT data, expires FROM session WHERE sid = ? AND expires > ?', (sid, time.time())
+        ).fetchone()
+
+    def set(self, sid: str, data: bytes, expires: float):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO session (sid, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+
+    def touch(self, sid: str, expires: float):
+        self.connection.execute('UPDATE session SET expires = ? WHERE sid = ?', (expires, sid))
+
+    def delete(self, sid: str):
+        self.connection.execute('DELETE FROM session WHERE sid = ?', (sid,))
+
+    # drop expired sessions, returns how many
+    def cleanup(self) -> int:
+        return self.connection.execute('DELETE FROM session WHERE expires <= ?', (time.time(),)).rowcount
+
+
+# session (SessionMixin is a MutableMapping) whose data is read from the store on first access
+class ServerSession(SessionMixin):
+
+    def __init__(self, sid: str = None, loader=None):
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.expires = None
+        self.regenerated = False
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> dict:
+        self.accessed = True
+        if self._data is None:
+            stored = self._loader(self.sid) if self.sid is not None else None
+            if stored is None:
+                # unknown or expired id, a new one is issued on save
+                self.sid = None
+                self.new = True
+                self._data = {}
+            else:
+                self._data, self.expires = stored
+        return self._data
+
+    # keep the data under a new id, the old one is deleted on save
+    def regenerate(self):
+        self.data  # loaded under the old id
+        self.regenerated = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ServerSessionInterface(SessionInterface):
+
+    def __init__(self, app, store):
+        self.store = store
+        self.cleanup_every = app.config['SESSION_CLEANUP_EVERY']
+        self._saves = 0
+        self._saves_lock = threading.Lock()
+
+    def _signer(self, app) -> Signer:
+        return Signer(app.secret_key, salt=SID_SALT)
+
+    def _load(self, sid: str):
+        stored = self.store.get(sid)
+        if stored is None:
+            return None
+        data, expires = stored
+        try:
+            return pickle.loads(data), expires
+        except Exception:
+            return None
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode('utf-8')
+        except BadSignature:
+            return ServerSession()
+        return ServerSession(sid, self._load)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # never looked at during this request, nothing can have changed
+        if not session.loaded:
+            return
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.regenerated and session.sid is not None:
+            self.store.delete(session.sid)
+            session.sid = None
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        issue_cookie = session.sid is None
+        if issue_cookie:
+            session.sid = secrets.token_urlsafe(32)
+
+        if session.modified or issue_cookie:
+            self.store.set(session.sid, pickle.dumps(dict(session), pickle.HIGHEST_PROTOCOL), now + lifetime)
+            self._cleanup_periodically()
+            issue_cookie = issue_cookie or session.permanent
+        elif session.expires is not None and session.expires - now < lifetime / 2:
+            self.store.touch(session.sid, now + lifetime)
+            issue_cookie = session.permanent
+
+        # the cookie only changes with the id, or with the expiry of a permanent session
+        if issue_cookie:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _cleanup_periodically(self):
+        if not self.cleanup_every:
+            return
+        with self._saves_lock:
+            self._saves += 1
+            due = self._saves % self.cleanup_every == 0
+        if due:
+            self.store.cleanup()
+
+
+# flask_login signal handler: a new session id for every login
+def regenerate_session(app, user=None, **kwargs):
+    if isinstance(session, ServerSession):
+        session.regenerate()
+
+
+# SESSION_BACKEND: 'cookie' keeps Flask's signed cookie sessions, None the
+# local SQLite store, anything else is a 'module:Class' store
+def init_sessions(app):
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return None
+    if backend is None:
+        backend = SQLiteSessionStore
+    elif isinstance(backend, str):
+        backend = import_string(backend)
+
+    app.session_interface = ServerSessionInterface(app, backend(app))
+    user_logged_in.connect(regenerate_session, app)
+    return app.session_interface
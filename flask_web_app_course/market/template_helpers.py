@@ -0,0 +1,17 @@
+# native imports
+from functools import lru_cache
+
+
+# Jinja filters and helpers of the market templates, registered on the app by
+# init_template_helpers().
+
+# '1,234' style amounts for budgets and prices. The same few values are
+# formatted on every page (the navbar budget, catalog prices), so results are
+# memoized by value; a changed budget is just another key, nothing to invalidate.
+@lru_cache(maxsize=4096)
+def format_money(amount: int) -> str:
+    return f'{amount:,}'
+
+
+def init_template_helpers(app):
+    app.add_template_filter(format_money, 'money')
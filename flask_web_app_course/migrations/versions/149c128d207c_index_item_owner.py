@@ -0,0 +1,25 @@
+"""index item owner
+
+Revision ID: 149c128d207c
+Revises: 1cc588b35817
+Create Date: 2026-10-18 06:29:29.760028
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '149c128d207c'
+down_revision = '1cc588b35817'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # both market listings filter on item.owner
+    op.create_index('ix_item_owner', 'item', ['owner'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_item_owner', table_name='item')
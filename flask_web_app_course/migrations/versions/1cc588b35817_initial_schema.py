@@ -0,0 +1,48 @@
+"""initial schema
+
+Revision ID: 1cc588b35817
+Revises: 
+Create Date: 2026-10-18 06:29:28.708346
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1cc588b35817'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the user and item tables as first created by db.create_all()
+    op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=30), nullable=False),
+        sa.Column('email', sa.String(length=50), nullable=False),
+        sa.Column('password_hash', sa.String(length=60), nullable=False),
+        sa.Column('budget', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+        sa.UniqueConstraint('email')
+    )
+    op.create_table('item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=30), nullable=False),
+        sa.Column('price', sa.Integer(), nullable=False),
+        sa.Column('barcode', sa.String(length=12), nullable=False),
+        sa.Column('description', sa.String(length=1024), nullable=False),
+        sa.Column('owner', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+        sa.UniqueConstraint('barcode'),
+        sa.UniqueConstraint('description')
+    )
+
+
+def downgrade():
+    op.drop_table('item')
+    op.drop_table('user')
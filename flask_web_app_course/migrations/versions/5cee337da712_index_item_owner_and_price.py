@@ -0,0 +1,25 @@
+"""index item owner and price
+
+Revision ID: 5cee337da712
+Revises: fe58d18f37a0
+Create Date: 2026-10-18 06:29:31.692931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5cee337da712'
+down_revision = 'fe58d18f37a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # price range filters on the market (owner IS NULL) and per owner
+    op.create_index('ix_item_owner_price', 'item', ['owner', 'price'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_item_owner_price', table_name='item')
@@ -0,0 +1,51 @@
+"""add item search index
+
+Revision ID: c564efca6cf7
+Revises: 5cee337da712
+Create Date: 2026-10-18 06:29:32.735706
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c564efca6cf7'
+down_revision = '5cee337da712'
+branch_labels = None
+depends_on = None
+
+
+# Statements of market/search.py at the time of this revision. Copied rather
+# than imported, later changes to the module must not rewrite history.
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "name, description, content='item', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF name, description ON item BEGIN "
+    "INSERT INTO item_fts (item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO item_fts (rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+
+
+# FTS5 exists on SQLite only, other databases search with LIKE
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in FTS_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO item_fts (item_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('item_fts_insert', 'item_fts_delete', 'item_fts_update'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS item_fts')
@@ -0,0 +1,48 @@
+"""add budget ledger
+
+Revision ID: fe58d18f37a0
+Revises: 149c128d207c
+Create Date: 2026-10-18 06:29:30.699438
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fe58d18f37a0'
+down_revision = '149c128d207c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ledger_entry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=10), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('settled', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['item.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ledger_entry_user_id_settled', 'ledger_entry', ['user_id', 'settled'], unique=False)
+
+    # open the ledger of existing users with their current budget, settled,
+    # so balances and 'flask ledger reconcile' agree right after the upgrade
+    user = sa.table('user', sa.column('id'), sa.column('budget'))
+    ledger_entry = sa.table('ledger_entry', sa.column('user_id'), sa.column('amount'),
+                            sa.column('kind'), sa.column('created_at'), sa.column('settled'))
+    op.execute(ledger_entry.insert().from_select(
+        ['user_id', 'amount', 'kind', 'created_at', 'settled'],
+        sa.select(user.c.id, user.c.budget, sa.literal('opening'),
+                  sa.func.current_timestamp(), sa.true())
+    ))
+
+
+def downgrade():
+    op.drop_index('ix_ledger_entry_user_id_settled', table_name='ledger_entry')
+    op.drop_table('ledger_entry')
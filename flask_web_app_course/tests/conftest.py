@@ -0,0 +1,51 @@
+# native imports
+import os
+import tempfile
+
+# the app reads its settings at import time, point it at scratch databases
+scratch = tempfile.mkdtemp(prefix='market-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch, 'market.db')}"
+os.environ['SESSION_SQLITE_PATH'] = os.path.join(scratch, 'sessions.db')
+for name in ('SESSION_BACKEND', 'MARKET_CACHE_BACKEND', 'PURCHASE_QUEUE_BACKEND', 'RATELIMIT_BACKEND'):
+    os.environ.pop(name, None)
+
+# 3rd party imports
+import pytest
+
+# local imports
+from market import app, db, cache, user_cache, limiter, purchase_queue
+from market.models import User
+from market.purchase_queue import LocalPurchaseBackend
+from market.ratelimit import LocalRateLimitBackend
+
+
+# Fresh tables, caches, purchase claims and rate limits for every test. Tests
+# may change app.config, it is restored afterwards.
+@pytest.fixture
+def market_app():
+    config = dict(app.config)
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, BCRYPT_LOG_ROUNDS=4)
+    cache.clear()
+    user_cache.clear()
+    limiter.backend = LocalRateLimitBackend(app)
+    purchase_queue.backend = LocalPurchaseBackend(app)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    app.config.clear()
+    app.config.update(config)
+
+
+@pytest.fixture
+def make_user(market_app):
+    def make_user(username, password='secret1', budget=1000):
+        with market_app.app_context():
+            user = User(username=username, email=f'{username}@example.com', password=password,
+                        budget=budget)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return make_user
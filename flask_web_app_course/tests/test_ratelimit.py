@@ -0,0 +1,49 @@
+# 3rd party imports
+import pytest
+
+
+@pytest.fixture
+def client(market_app, make_user):
+    market_app.config.update(LOGIN_RATE_LIMIT=True, LOGIN_IP_BURST=20, LOGIN_IP_PER_MINUTE=10,
+                             LOGIN_USER_BURST=5, LOGIN_USER_PER_MINUTE=3,
+                             LOGIN_ACCOUNT_BURST=100, LOGIN_ACCOUNT_PER_MINUTE=30)
+    make_user('bob')
+    return market_app.test_client()
+
+
+def login(client, password, remote_addr='10.0.0.1', username='bob'):
+    return client.post('/login', data={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': remote_addr})
+
+
+def test_failed_logins_are_throttled(client):
+    assert [login(client, 'wrong').status_code for _ in range(5)] == [200] * 5
+
+    response = login(client, 'secret1')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+# Guessing from one address must not lock the account owner out.
+def test_one_client_cannot_lock_out_a_user(client):
+    for _ in range(25):
+        login(client, 'wrong')
+    assert login(client, 'wrong').status_code == 429
+
+    assert login(client, 'secret1', remote_addr='10.0.0.2').status_code == 302
+
+
+def test_successful_logins_are_not_charged(client):
+    assert [login(client, 'secret1').status_code for _ in range(30)] == [302] * 30
+
+
+def test_one_client_cannot_try_many_users(client):
+    codes = [login(client, 'wrong', username=f'user{i}').status_code for i in range(21)]
+    assert codes == [200] * 20 + [429]
+
+
+def test_zero_rate_turns_the_bucket_off(client):
+    client.application.config.update(LOGIN_IP_BURST=8, LOGIN_USER_PER_MINUTE=0,
+                                     LOGIN_ACCOUNT_PER_MINUTE=0)
+    assert [login(client, 'wrong').status_code for _ in range(8)] == [200] * 8
+    assert login(client, 'wrong').status_code == 429
@@ -0,0 +1,34 @@
+# 3rd party imports
+import pytest
+
+
+@pytest.fixture
+def client(market_app, make_user):
+    market_app.config['LOGIN_RATE_LIMIT'] = False
+    make_user('fixated')
+    return market_app.test_client()
+
+
+def session_cookie(client):
+    cookie = client.get_cookie(client.application.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie else None
+
+
+# An attacker who planted a session id before the login must not be logged in with it.
+def test_login_issues_a_new_session_id(client):
+    # the 'please log in' flash of a protected page opens an anonymous session
+    client.get('/market')
+    planted = session_cookie(client)
+    assert planted is not None
+
+    response = client.post('/login', data={'username': 'fixated', 'password': 'secret1'})
+    assert response.status_code == 302
+    issued = session_cookie(client)
+    assert issued is not None and issued != planted
+    assert client.get('/market').status_code == 200
+
+    attacker = client.application.test_client()
+    attacker.set_cookie(client.application.config['SESSION_COOKIE_NAME'], planted)
+    response = attacker.get('/market')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
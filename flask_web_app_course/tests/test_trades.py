@@ -0,0 +1,222 @@
+# native imports
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party imports
+import pytest
+from sqlalchemy import event
+
+# local imports
+from market import db, purchase_queue
+from market.models import Item, User, LedgerEntry, TradeResult, settle_ledger
+
+
+@pytest.fixture
+def market(market_app):
+    # settlement is tested on its own, trades leave their entries pending
+    market_app.config['LEDGER_SETTLE_EVERY'] = 0
+    return market_app
+
+
+@pytest.fixture
+def add_items(market):
+    def add_items(*prices):
+        with market.app_context():
+            items = [Item(name=f'item{price}-{n}', price=price, barcode=f'{price:06d}{n:06d}',
+                          description=f'item {price} {n}') for n, price in enumerate(prices)]
+            db.session.add_all(items)
+            db.session.commit()
+            return [item.id for item in items]
+    return add_items
+
+
+# run Item.buy or Item.sell in a fresh app context, as a request would
+def trade(app, action: str, item_id: int, user_id: int) -> TradeResult:
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        return getattr(db.session.get(Item, item_id), action)(user)
+
+
+# the same trade from several threads released at once
+def concurrently(app, action: str, pairs: list) -> list:
+    start = threading.Barrier(len(pairs))
+
+    def run(pair):
+        start.wait()
+        return trade(app, action, *pair)
+
+    with ThreadPoolExecutor(len(pairs)) as pool:
+        return list(pool.map(run, pairs))
+
+
+def balance(app, user_id: int) -> int:
+    with app.app_context():
+        return db.session.get(User, user_id).balance
+
+
+def owner(app, item_id: int):
+    with app.app_context():
+        return db.session.get(Item, item_id).owner
+
+
+def test_buy_claims_the_item_and_charges_the_buyer(market, make_user, add_items):
+    buyer = make_user('buyer')
+    item, = add_items(300)
+
+    assert trade(market, 'buy', item, buyer) is TradeResult.SUCCESS
+    assert owner(market, item) == buyer
+    assert balance(market, buyer) == 700
+
+
+def test_an_owned_item_cannot_be_bought_again(market, make_user, add_items):
+    first, second = make_user('first'), make_user('second')
+    item, = add_items(300)
+    trade(market, 'buy', item, first)
+
+    assert trade(market, 'buy', item, second) is TradeResult.UNAVAILABLE
+    assert owner(market, item) == first
+    assert balance(market, second) == 1000
+
+
+def test_concurrent_buyers_get_the_item_once(market, make_user, add_items):
+    buyers = [make_user(f'buyer{n}') for n in range(8)]
+    item, = add_items(300)
+
+    results = concurrently(market, 'buy', [(item, buyer) for buyer in buyers])
+
+    assert results.count(TradeResult.SUCCESS) == 1
+    assert results.count(TradeResult.UNAVAILABLE) == len(buyers) - 1
+    winner = buyers[results.index(TradeResult.SUCCESS)]
+    assert owner(market, item) == winner
+    assert [balance(market, buyer) for buyer in buyers].count(700) == 1
+    with market.app_context():
+        assert LedgerEntry.query.filter_by(kind='buy').count() == 1
+
+
+def test_insufficient_funds_leave_the_item_on_the_market(market, make_user, add_items):
+    buyer = make_user('buyer', budget=200)
+    item, = add_items(300)
+
+    assert trade(market, 'buy', item, buyer) is TradeResult.INSUFFICIENT_FUNDS
+    assert owner(market, item) is None
+    assert balance(market, buyer) == 200
+
+
+def test_only_the_owner_can_sell(market, make_user, add_items):
+    owner_id, other = make_user('owner'), make_user('other')
+    item, = add_items(300)
+    trade(market, 'buy', item, owner_id)
+
+    assert trade(market, 'sell', item, other) is TradeResult.NOT_OWNER
+    assert owner(market, item) == owner_id
+    assert balance(market, other) == 1000
+
+    assert trade(market, 'sell', item, owner_id) is TradeResult.SUCCESS
+    assert owner(market, item) is None
+    assert balance(market, owner_id) == 1000
+
+
+# Item.buy through the purchase queue, as the market page calls it
+def queued_purchase(app, item_id: int, user_id: int, idempotency_key=None):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        return purchase_queue.purchase(item_id, user, idempotency_key=idempotency_key)
+
+
+def test_a_retried_purchase_gets_the_first_answer(market, make_user, add_items):
+    buyer = make_user('buyer')
+    item, = add_items(300)
+    assert queued_purchase(market, item, buyer, 'form-1')[0] is TradeResult.SUCCESS
+    trade(market, 'sell', item, buyer)
+
+    # the same form posted again is not a second purchase
+    assert queued_purchase(market, item, buyer, 'form-1')[0] is TradeResult.SUCCESS
+    assert owner(market, item) is None
+    assert balance(market, buyer) == 1000
+
+    assert queued_purchase(market, item, buyer, 'form-2')[0] is TradeResult.SUCCESS
+    assert owner(market, item) == buyer
+
+
+def test_a_sold_item_is_refused_without_a_query(market, make_user, add_items):
+    first, second = make_user('first'), make_user('second')
+    item, = add_items(300)
+    queued_purchase(market, item, first)
+
+    statements = []
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    with market.app_context():
+        user = db.session.get(User, second)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result, _, _ = purchase_queue.purchase(item, user)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert result is TradeResult.UNAVAILABLE
+    assert statements == []
+
+
+def test_a_buyer_queued_too_long_is_told_the_market_is_busy(market, make_user, add_items):
+    market.config['PURCHASE_LOCK_TIMEOUT'] = 0.05
+    buyer = make_user('buyer')
+    item, = add_items(300)
+
+    # another purchase of the item is in progress
+    with purchase_queue.backend.lock(item, timeout=1):
+        result, _, _ = queued_purchase(market, item, buyer)
+
+    assert result is TradeResult.BUSY
+    assert owner(market, item) is None
+    assert queued_purchase(market, item, buyer)[0] is TradeResult.SUCCESS
+
+
+# one buyer spending more than their balance from many requests at once
+def test_concurrent_purchases_never_overdraw(market, make_user, add_items):
+    buyer = make_user('buyer', budget=1000)
+    items = add_items(*[300] * 6)
+
+    results = concurrently(market, 'buy', [(item, buyer) for item in items])
+
+    assert results.count(TradeResult.SUCCESS) == 3
+    assert results.count(TradeResult.INSUFFICIENT_FUNDS) == 3
+    assert balance(market, buyer) == 100
+    assert sorted(owner(market, item) is None for item in items) == [False] * 3 + [True] * 3
+
+
+def test_settlement_folds_pending_entries_into_budgets(market, make_user, add_items):
+    buyer, seller = make_user('buyer'), make_user('seller')
+    cheap, dear = add_items(100, 300)
+    trade(market, 'buy', cheap, buyer)
+    trade(market, 'buy', dear, seller)
+    trade(market, 'sell', dear, seller)
+
+    with market.app_context():
+        assert db.session.get(User, buyer).budget == 1000
+        # in id order, one batch at a time
+        assert settle_ledger(batch_size=2) == 2
+        assert settle_ledger(batch_size=2) == 1
+        assert settle_ledger(batch_size=2) == 0
+        assert LedgerEntry.query.filter_by(settled=False).count() == 0
+
+    for user_id, expected in ((buyer, 900), (seller, 1000)):
+        with market.app_context():
+            user = db.session.get(User, user_id)
+            assert (user.budget, user.balance) == (expected, expected)
+
+    result = market.test_cli_runner().invoke(args=['ledger', 'reconcile'])
+    assert result.exit_code == 0, result.output
+    assert 'all budgets match the ledger' in result.output
+
+
+def test_reconcile_reports_a_budget_changed_outside_the_ledger(market, make_user):
+    make_user('buyer')
+    with market.app_context():
+        db.session.execute(User.__table__.update().values(budget=5000))
+        db.session.commit()
+
+    result = market.test_cli_runner().invoke(args=['ledger', 'reconcile'])
+    assert result.exit_code != 0
+    assert 'buyer: budget 5000, settled ledger 1000' in result.output
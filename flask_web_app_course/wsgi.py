@@ -0,0 +1,6 @@
+# WSGI entry point for production servers, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#   uwsgi --http :8000 --module wsgi:app
+# Settings (database url, pool size, ...) come from the environment, see
+# market/config.py. 'python run.py' stays the development server.
+from market import app